@@ -3,53 +3,195 @@
 # This file is licensed under MIT license.
 # See the LICENSE file in the project root for more information.
 
+import argparse
+import time
 import numpy as np
 import logging
-import pygame
-from pygame.locals import *
 
-from simulator.ecs.core import *
-from simulator.components.components import *
-from simulator.systems.systems import *
-from simulator.systems.render.pygame_render import PyGameRenderSystem
+from simulator.ecs.core import EventBus, Engine, Entity
+import simulator.ecs.stdevent as stdevent
+from simulator.components.components import PositionComponent, ControlComponent, KinematicComponent, \
+    VisualComponent, CameraComponent, RangeSensorComponent
+from simulator.systems.systems import sleep_system, WakeSystem
+from simulator.systems.bicycle import bicycle_system
+from simulator.systems.range_sensor import RangeSensorSystem
+import simulator.systems.render as render
+from simulator.systems.render.frame_recorder import FrameRecorder, RawVideoEncoder, ImageSequenceEncoder
+from simulator.ecs.replay import EventRecorder, EventReplayer
+from simulator.ecs.scenario import load_scenario, save_scenario
+from simulator.ecs.metrics import MetricsCollector, MetricsServer, MetricsFileDumper
 import simulator.events as events
-import simulator.helpers.log_helper
+import simulator.helpers.log_helper as log_helper
 
-log_helper.setLevel('Event Bus', logging.WARN)
 
+# Longest frame time accounted by the simulation, prevents spiral of death
+# when simulation can't keep up with the real time
+MAX_FRAME_TIME = 0.25
 
 # Game loop stopping
 main_loop = True
-def pyevent_system(state, dt):
+def quit_handler():
     global main_loop
-    for event in pygame.event.get():
-        if event.type == QUIT:
-            main_loop = False
+    main_loop = False
 
 
-def main():
-    engine = Engine()
+def parse_args():
+    parser = argparse.ArgumentParser(description='Simple car simulator')
+    parser.add_argument('--render', default='pygame', choices=render.available_backends() + ['none'],
+                        help='Render backend, "none" to run without rendering')
+    parser.add_argument('--offscreen', action='store_true',
+                        help='Render without window, as fast as possible')
+    parser.add_argument('--steps', type=int, default=None,
+                        help='Stop after given number of simulation steps')
+    parser.add_argument('--sim-rate', type=float, default=30.0,
+                        help='Simulation steps per second of the simulated time')
+    parser.add_argument('--fps', type=float, default=30.0,
+                        help='Rendered frames per second')
+    parser.add_argument('--record', default=None,
+                        help='Record frames to the raw RGB24 video file (*.rgb) or images directory')
+    parser.add_argument('--scenario', default=None,
+                        help='Load world from the scenario file instead of the built-in one')
+    parser.add_argument('--save-scenario', default=None,
+                        help='Save initial world to the scenario file')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Serve Prometheus metrics on the local port')
+    parser.add_argument('--metrics-file', default=None,
+                        help='Periodically dump Prometheus metrics to the file')
+    parser.add_argument('--record-events', default=None,
+                        help='Record all events to the binary log')
+    parser.add_argument('--replay', default=None,
+                        help='Replay events log headless and exit')
+    parser.add_argument('--replay-step', type=int, default=None,
+                        help='Stop replay at given step')
+    parser.add_argument('--replay-verify', action='store_true',
+                        help='Check that replay from every keyframe reaches the next one')
+    return parser.parse_args()
 
-    # Setup all systems. The order is important
-    EventBus.subscribe(stdevent.EVENT_UPDATE, pyevent_system)
-    EventBus.subscribe(stdevent.EVENT_UPDATE, control_system)
-    render_system = PyGameRenderSystem()
+
+# Real-time runs drop frames when encoding can't keep up,
+# headless runs wait for the encoder and keep every frame
+def create_recorder(path, block):
+    if path is None:
+        return None
+    if path.endswith('.rgb'):
+        return FrameRecorder(RawVideoEncoder(path), block=block)
+    return FrameRecorder(ImageSequenceEncoder(path), block=block)
+
+
+# Built-in scenario
+def create_world(engine):
+    # Create camera
+    camera = Entity('camera')
+    camera.add_component(CameraComponent(np.array([300.0, 300.0])))
+    engine.add_entity(camera)
 
     # Create entity
     car = Entity('car1')
-    car.add_component(PositionComponent(np.array([100.0, 100.0])))
+    car.add_component(PositionComponent(np.array([300.0, 100.0])))
     car.add_component(VisualComponent((255, 0, 0)))
-    car.add_component(ControlComponent(np.array([10, 0])))
+    car.add_component(ControlComponent(np.array([10, 0]), -15.0))
     car.add_component(KinematicComponent((60, 30)))
+    car.add_component(RangeSensorComponent())
     engine.add_entity(car)
 
+
+# Subscribes simulation systems. The order is important
+def setup_systems():
+    RangeSensorSystem()
+    EventBus.subscribe(stdevent.EVENT_UPDATE, bicycle_system)
+    EventBus.subscribe(stdevent.EVENT_UPDATE, sleep_system)
+    WakeSystem()
+
+
+def replay(path, step, verify):
+    engine = Engine()
+    setup_systems()
+
+    # Replay is headless, camera is moved only by the input
+    replayer = EventReplayer(path, skip_ids=(events.EVENT_SNAPSHOT, events.EVENT_RENDER),
+                             input_components=(CameraComponent,))
+    if verify:
+        failures = replayer.verify(engine)
+        if failures:
+            logging.error('{} keyframes are not reproduced by replay'.format(len(failures)))
+        else:
+            logging.info('All keyframes are reproduced by replay')
+    start = time.time()
+    replayer.seek(engine, replayer.steps if step is None else step)
+    logging.info('Replayed {} steps ({:.2f}s of simulated time) in {:.2f}s'.format(
+        replayer.step, float(np.sum(replayer.dts[:replayer.step])), time.time() - start))
+
+
+def main():
+    args = parse_args()
+    log_helper.setupRootLogger()
+    log_helper.setLevel('Event Bus', logging.WARN)
+
+    if args.replay is not None:
+        replay(args.replay, args.replay_step, args.replay_verify)
+        return
+
+    engine = Engine()
+    backend = render.load_backend(args.render) if args.render != 'none' else None
+    headless = backend is None or args.offscreen
+    recorder = create_recorder(args.record, headless) if backend is not None else None
+
+    # Setup all systems. The order is important
+    EventBus.subscribe(events.EVENT_QUIT, quit_handler)
+    if not headless:
+        EventBus.subscribe(stdevent.EVENT_UPDATE, backend.input_system)
+    setup_systems()
+    if backend is not None:
+        render_system = backend.RenderSystem(offscreen=args.offscreen, recorder=recorder)
+
+    if args.scenario is not None:
+        logging.info('Loaded {} entities'.format(load_scenario(args.scenario, engine)))
+    else:
+        create_world(engine)
+    if args.save_scenario is not None:
+        save_scenario(args.save_scenario, engine)
+
     # Notify renderer that all graphics is set
     EventBus.publish(events.EVENT_INIT_GRAPHICS, engine)
+    events_recorder = EventRecorder(args.record_events, engine) if args.record_events is not None else None
+    metrics = MetricsCollector(engine)
+    metrics_server = MetricsServer(metrics, args.metrics_port) if args.metrics_port is not None else None
+    metrics_dumper = MetricsFileDumper(metrics, args.metrics_file) if args.metrics_file is not None else None
+
+    # Simulation runs with fixed step, renderer interpolates between the steps
+    sim_dt = 1.0 / args.sim_rate
+    frame_dt = 1.0 / args.fps
+    frame_start = time.time()
+    accumulator = 0.0
+    step = 0
+    while main_loop and (args.steps is None or step < args.steps):
+        if headless:
+            accumulator += frame_dt
+        else:
+            time.sleep(max(0.0, frame_start + frame_dt - time.time()))
+            now = time.time()
+            accumulator += min(now - frame_start, MAX_FRAME_TIME)
+            frame_start = now
+        substeps = 0
+        while accumulator >= sim_dt and (args.steps is None or step + substeps < args.steps):
+            accumulator -= sim_dt
+            substeps += 1
+        for i in range(substeps):
+            engine.update(sim_dt)
+            # Frame is interpolated between the two last steps, only they are stored by the renderer
+            if i >= substeps - 2:
+                EventBus.publish(events.EVENT_SNAPSHOT, engine)
+        step += substeps
+        EventBus.publish(events.EVENT_RENDER, engine, min(accumulator / sim_dt, 1.0))
 
-    clock = pygame.time.Clock()
-    while main_loop:
-        clock.tick(30)
-        engine.update(1/30.0)
+    if recorder is not None:
+        recorder.close()
+    if events_recorder is not None:
+        events_recorder.close()
+    if metrics_server is not None:
+        metrics_server.close()
+    if metrics_dumper is not None:
+        metrics_dumper.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,55 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Measures startup time of the headless simulation: fresh interpreter
+# importing the core and building a small world. Every run is done in the
+# separate process, so nothing is cached between runs.
+#
+# Usage: python research/bench_startup.py [runs] [cars]
+
+import os
+import subprocess
+import sys
+
+# Target for the median startup time, seconds
+STARTUP_TARGET = 0.25
+
+SCRIPT = '''
+import time
+start = time.time()
+import simulator
+import numpy as np
+from simulator.ecs.core import Engine, Entity
+from simulator.components.components import PositionComponent, ControlComponent, KinematicComponent
+from simulator.systems.systems import control_system
+engine = Engine()
+for i in range({cars}):
+    car = Entity('car{{}}'.format(i))
+    car.add_component(PositionComponent(np.array([10.0 * i, 0.0])))
+    car.add_component(ControlComponent(np.array([1.0, 0.0])))
+    car.add_component(KinematicComponent((60, 30)))
+    engine.add_entity(car)
+assert 'pygame' not in __import__('sys').modules, 'pygame imported by the core'
+print('startup: {{}}'.format(time.time() - start))
+'''
+
+
+def measure(cars):
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT.format(cars=cars)], cwd=root)
+    line = next(line for line in output.decode().splitlines() if line.startswith('startup: '))
+    return float(line[len('startup: '):])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    cars = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    times = sorted(measure(cars) for _ in range(runs))
+    median = times[len(times) // 2]
+    print('Startup with {} cars: median {:.1f} ms, min {:.1f} ms, max {:.1f} ms (target {:.0f} ms)'.format(
+        cars, median * 1000, times[0] * 1000, times[-1] * 1000, STARTUP_TARGET * 1000))
+    return 0 if median <= STARTUP_TARGET else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
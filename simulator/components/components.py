@@ -1,7 +1,7 @@
 # This file is licensed under MIT license.
 # See the LICENSE file in the project root for more information.
 
-from simulator.ecs.core import *
+from simulator.ecs.core import BaseComponent
 import numpy as np
 
 
@@ -13,19 +13,53 @@ class PositionComponent(BaseComponent):
 
 
 class ControlComponent(BaseComponent):
-    def __init__(self, acc=np.zeros(2)):
+    def __init__(self, acc=np.zeros(2), steer=0.0):
         super(ControlComponent, self).__init__()
         self.acc = acc
+        self.steer = steer
+        self.idle_steps = 0  # Steps without movement, see sleep_system
 
 
 class KinematicComponent(BaseComponent):
-    def __init__(self, size):
+    def __init__(self, size, wheelbase=None):
         super(KinematicComponent, self).__init__()
         self.speed = np.zeros(2)
         self.size = size
+        self.wheelbase = wheelbase if wheelbase is not None else size[0]
 
 
 class VisualComponent(BaseComponent):
     def __init__(self, color):
         super(self.__class__, self).__init__()
         self.color = color
+
+
+class CameraComponent(BaseComponent):
+    def __init__(self, center=np.zeros(2), zoom=1.0):
+        super(CameraComponent, self).__init__()
+        self.center = center
+        self.zoom = zoom
+
+
+class RoadComponent(BaseComponent):
+    def __init__(self, points, lines_cnt, lines_width):
+        super(RoadComponent, self).__init__()
+        self.points = points
+        self.lines_cnt = lines_cnt
+        self.lines_width = lines_width
+
+    def __setattr__(self, name, value):
+        super(RoadComponent, self).__setattr__(name, value)
+        # Data computed from the geometry by systems is kept in ext.derived,
+        # it's dropped when the geometry or ext itself is assigned
+        if name in ('points', 'lines_cnt', 'lines_width', 'ext'):
+            self.ext.derived = {}
+
+
+class RangeSensorComponent(BaseComponent):
+    def __init__(self, rays=16, fov=360.0, max_range=200.0):
+        super(RangeSensorComponent, self).__init__()
+        self.rays = rays
+        self.fov = fov
+        self.max_range = max_range
+        self.ranges = np.full(rays, float(max_range))
@@ -1,9 +1,8 @@
 # This file is licensed under MIT license.
 # See the LICENSE file in the project root for more information.
 
-import stdevent
-import log_helper
-import logging
+import simulator.ecs.stdevent as stdevent
+import simulator.helpers.log_helper as log_helper
 
 event_logger = log_helper.getLogger('Event Bus')
 engine_logger = log_helper.getLogger('ECS Core')
@@ -24,6 +23,26 @@ class EventBus(object):
 
     __events = {}
     __latched_events = {}
+    __recorder = None
+    __publish_counts = {}
+    __depth = 0
+
+    @staticmethod
+    def set_recorder(recorder):
+        """
+        Sets the function called on every publish with (id, args)
+        before the event is passed to subscribers
+        :param recorder: Callable or None to disable recording
+        """
+        EventBus.__recorder = recorder
+
+    @staticmethod
+    def depth():
+        """
+        Gets number of publishes in progress. Inside the recorder it's 0
+        for the top-level events and greater for the events published by callbacks
+        """
+        return EventBus.__depth
 
     @staticmethod
     def subscribe( id, callback):
@@ -34,10 +53,10 @@ class EventBus(object):
         """
         EventBus.__register_is_not(id)
         EventBus.__events[id].append(callback)
-        event_logger.debug('Event {} subscribed'.format(id))
+        event_logger.debug('Event %s subscribed', id)
 
         if id in EventBus.__latched_events:
-            event_logger.debug('Latched event {} sent to the new subscriber'.format(id))
+            event_logger.debug('Latched event %s sent to the new subscriber', id)
             callback(*EventBus.__latched_events[id])
 
     @staticmethod
@@ -49,7 +68,7 @@ class EventBus(object):
         """
         if id in EventBus.__events:
             del EventBus.__events[callback]
-            event_logger.debug('Event {} unsubscribed'.format(id))
+            event_logger.debug('Event %s unsubscribed', id)
 
     @staticmethod
     def publish(id, *args):
@@ -60,9 +79,16 @@ class EventBus(object):
         :param args: Data will be send to every callback
         """
         EventBus.__register_is_not(id)
-        event_logger.debug('Event {} published'.format(id))
-        for callback in EventBus.__events[id]:
-            callback(*args)
+        event_logger.debug('Event %s published', id)
+        EventBus.__publish_counts[id] += 1
+        if EventBus.__recorder is not None:
+            EventBus.__recorder(id, args)
+        EventBus.__depth += 1
+        try:
+            for callback in EventBus.__events[id]:
+                callback(*args)
+        finally:
+            EventBus.__depth -= 1
 
     @staticmethod
     def publish_latched(id, *args):
@@ -74,15 +100,24 @@ class EventBus(object):
         :param id: Event ID
         :param args: Data will be send to every callback
         """
-        EventBus.publish(id, args)
-        event_logger.debug('Latched event {} stored'.format(id))
+        EventBus.publish(id, *args)
+        event_logger.debug('Latched event %s stored', id)
         EventBus.__latched_events[id] = args
 
+    @staticmethod
+    def publish_counts():
+        """
+        Gets number of publishes of every event
+        :return: Dictionary {event id: count}
+        """
+        return dict(EventBus.__publish_counts)
+
     @staticmethod
     def __register_is_not(id):
         if id not in EventBus.__events:
-            event_logger.debug('Event {} registred'.format(id))
+            event_logger.debug('Event %s registred', id)
             EventBus.__events[id] = []
+            EventBus.__publish_counts[id] = 0
 
 
 class Engine(object):
@@ -93,10 +128,19 @@ class Engine(object):
     def __init__(self):
         engine_logger.debug('Initialization')
         self.__entities = []
-        self.__components = []
+        self.__entities_set = set()  # Fast membership check
+        # Components by exact class: {class: {component: None}}, dictionaries keep the add order
+        # and allow fast removal. Components of the sleeping entities are not in the active index.
+        self.__components = {}
+        self.__active_components = {}
+        self.__sleeping = set()
+        self.__steps = 0
+        self.__sim_time = 0.0
 
         EventBus.subscribe(stdevent.EVENT_COMPONENT_ADDED, self.__component_added)
         EventBus.subscribe(stdevent.EVENT_COMPONENT_REMOVED, self.__component_removed)
+        EventBus.subscribe(stdevent.EVENT_ENTITY_SLEEP, self.__entity_sleep)
+        EventBus.subscribe(stdevent.EVENT_ENTITY_WAKE, self.__entity_wake)
         EventBus.publish_latched(stdevent.EVENT_SETUP, self)
 
     def __del__(self):
@@ -104,32 +148,122 @@ class Engine(object):
         EventBus.publish_latched(stdevent.EVENT_TEARDOWN)
 
     def __component_added(self, component):
-        self.__components.append(component)
+        self.__components.setdefault(component.__class__, {})[component] = None
+        if component.parent.sleeping:
+            component.parent.wake()
+        else:
+            self.__active_components.setdefault(component.__class__, {})[component] = None
 
     def __component_removed(self, component):
-        self.__components.remove(component)
+        self.__components[component.__class__].pop(component, None)
+        self.__active_components.get(component.__class__, {}).pop(component, None)
+
+    def __entity_sleep(self, entity):
+        self.__sleeping.add(entity)
+        for component_class, components in entity.components.items():
+            active = self.__active_components.get(component_class, {})
+            for component in components:
+                active.pop(component, None)
+
+    def __entity_wake(self, entity):
+        self.__sleeping.discard(entity)
+        for component_class, components in entity.components.items():
+            known = self.__components.get(component_class, {})
+            active = self.__active_components.setdefault(component_class, {})
+            for component in components:
+                if component in known:
+                    active[component] = None
+
+    @staticmethod
+    def __select(index, component_class):
+        # Index is by exact class, components of the subclasses are collected too
+        result = []
+        for indexed_class, components in index.items():
+            if issubclass(indexed_class, component_class):
+                result.extend(components)
+        return result
 
     def update(self, dt):
         EventBus.publish(stdevent.EVENT_UPDATE, self, dt)
+        self.__steps += 1
+        self.__sim_time += dt
+
+    @property
+    def steps(self):
+        """
+        Number of update calls
+        """
+        return self.__steps
+
+    @property
+    def sim_time(self):
+        """
+        Sum of dt of all update calls
+        """
+        return self.__sim_time
+
+    @property
+    def components(self):
+        """
+        Gets list of all components
+        """
+        # Dictionaries are copied first, so the list can be taken from the other thread
+        return [component for components in list(self.__components.values()) for component in list(components)]
+
+    @property
+    def entities(self):
+        """
+        Gets list of all entities.
+        WARNING: This methods returns actual list, DO NOT MODIFY MANUALLY
+        """
+        return self.__entities
 
     def add_entity(self, entity):
-        if entity not in self.__entities:
+        if entity not in self.__entities_set:
             self.__entities.append(entity)
+            self.__entities_set.add(entity)
+            EventBus.publish(stdevent.EVENT_ENTITY_ADDED, entity)
         else:
             raise RuntimeError('Entity already added to the Engine')
 
     def remove_entity(self, entity):
-        if entity in self.__entities:
+        if entity in self.__entities_set:
             self.__entities.remove(entity)
+            self.__entities_set.remove(entity)
+            self.__sleeping.discard(entity)
+            EventBus.publish(stdevent.EVENT_ENTITY_REMOVED, entity)
         else:
             raise RuntimeError('Entity not in the Engine')
 
     def get_entities_with_components(self, components_list):
         return [entity for entity in self.__entities if
-                all((entity.has_component_class(comp) for comp in components_list))]
+                all((entity.has_components_of_class(comp) for comp in components_list))]
 
     def get_components_by_class(self, component_class):
-        return [comp for comp in self.__components if isinstance(comp, component_class)]
+        return self.__select(self.__components, component_class)
+
+    def get_active_entities_with_components(self, components_list):
+        """
+        Same as get_entities_with_components, but skips sleeping entities
+        """
+        return [entity for entity in self.get_entities_with_components(components_list)
+                if entity not in self.__sleeping]
+
+    def get_active_components_by_class(self, component_class):
+        """
+        Same as get_components_by_class, but skips components of sleeping entities
+        """
+        return self.__select(self.__active_components, component_class)
+
+    def is_sleeping(self, entity):
+        return entity in self.__sleeping
+
+    @property
+    def sleeping_entities(self):
+        """
+        Gets list of the sleeping entities
+        """
+        return list(self.__sleeping)
 
 
 class Holder(object):
@@ -138,7 +272,10 @@ class Holder(object):
 
 class BaseComponent(object):
     """
-    Base class for components, allows access to it's parent entity
+    Base class for components, allows access to it's parent entity.
+    Assigning any attribute of the component wakes up its sleeping entity.
+    NOTE: in-place modification of the attribute content (comp.pos[0] = 1)
+          is not tracked, use assignment (comp.pos = ..., comp.pos += ...)
     """
 
     def __init__(self):
@@ -166,6 +303,12 @@ class BaseComponent(object):
         else:
             raise SystemError('Component not added to entity')
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        parent = self.__dict__.get('_BaseComponent__parent')
+        if parent is not None and parent.sleeping:
+            parent.wake()
+
     @property
     def parent(self):
         return self.__parent
@@ -180,11 +323,35 @@ class Entity(object):
     def __init__(self, name):
         self.__name = name
         self.__components = {}
+        self.__sleeping = False
 
     @property
     def name(self):
         return self.__name
 
+    @property
+    def sleeping(self):
+        """
+        Sleeping entities state doesn't change, so systems can skip them
+        """
+        return self.__sleeping
+
+    def sleep(self):
+        """
+        Puts entity to sleep
+        """
+        if not self.__sleeping:
+            self.__sleeping = True
+            EventBus.publish(stdevent.EVENT_ENTITY_SLEEP, self)
+
+    def wake(self):
+        """
+        Wakes up sleeping entity
+        """
+        if self.__sleeping:
+            self.__sleeping = False
+            EventBus.publish(stdevent.EVENT_ENTITY_WAKE, self)
+
     def add_component(self, component):
         """
         Adds component to the entity.
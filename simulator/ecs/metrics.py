@@ -0,0 +1,202 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Engine metrics in Prometheus text format.
+#
+# Engine and EventBus only increment plain counters, everything else
+# (counts per class, memory estimates, real-time factor) is computed when
+# metrics are collected: on the HTTP scrape or periodic file dump.
+# Memory is estimated from a sample of components of every class.
+
+import os
+import random
+import sys
+import threading
+import time
+import numpy as np
+from simulator.ecs.core import EventBus
+import simulator.helpers.log_helper as log_helper
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+metrics_logger = log_helper.getLogger('Metrics')
+
+PREFIX = 'kinesim_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _object_size(value):
+    if isinstance(value, np.ndarray):
+        return sys.getsizeof(value) + (value.nbytes if value.base is not None else 0)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def component_size(component):
+    """
+    Estimates memory used by the component and its attributes (ext data is not counted)
+    """
+    return sys.getsizeof(component) + sys.getsizeof(vars(component)) + \
+        sum(_object_size(value) for name, value in vars(component).items() if name != 'ext')
+
+
+def _format_value(value):
+    if isinstance(value, (int, np.integer)):
+        return str(value)
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsCollector(object):
+    """
+    Collects Engine metrics
+    """
+
+    def __init__(self, engine, sample_size=100):
+        """
+        :param engine: Engine
+        :param sample_size: Number of components of every class used for the memory estimation
+        """
+        self.__engine = engine
+        self.__sample_size = sample_size
+        self.__lock = threading.Lock()
+        self.__last_wall = time.time()
+        self.__last_sim_time = engine.sim_time
+
+    def collect(self):
+        """
+        Gets current metrics
+        :return: List of (name, type, help, [(labels dictionary, value)])
+        """
+        with self.__lock:
+            return self.__collect()
+
+    def render(self):
+        """
+        Gets current metrics in Prometheus text format
+        """
+        lines = []
+        for name, metric_type, help, samples in self.collect():
+            lines.append('# HELP {}{} {}'.format(PREFIX, name, help))
+            lines.append('# TYPE {}{} {}'.format(PREFIX, name, metric_type))
+            for labels, value in samples:
+                if labels:
+                    labels = ','.join('{}="{}"'.format(key, _escape(labels[key])) for key in sorted(labels))
+                    lines.append('{}{}{{{}}} {}'.format(PREFIX, name, labels, _format_value(value)))
+                else:
+                    lines.append('{}{} {}'.format(PREFIX, name, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def __collect(self):
+        engine = self.__engine
+        now = time.time()
+        sim_time = engine.sim_time
+        wall_delta = now - self.__last_wall
+        rtf = (sim_time - self.__last_sim_time) / wall_delta if wall_delta > 0 else 0.0
+        self.__last_wall = now
+        self.__last_sim_time = sim_time
+
+        # Lists are copied, simulation can change them while metrics are collected
+        by_class = {}
+        for component in list(engine.components):
+            by_class.setdefault(component.__class__.__name__, []).append(component)
+
+        memory = []
+        for class_name, components in sorted(by_class.items()):
+            sample = components if len(components) <= self.__sample_size else \
+                random.sample(components, self.__sample_size)
+            average = sum(component_size(component) for component in sample) / float(len(sample))
+            memory.append(({'class': class_name}, average * len(components)))
+
+        return [
+            ('steps_total', 'counter', 'Number of simulation steps', [({}, engine.steps)]),
+            ('sim_time_seconds_total', 'counter', 'Simulated time', [({}, sim_time)]),
+            ('real_time_factor', 'gauge', 'Simulated time per wall time since the previous collection',
+             [({}, rtf)]),
+            ('entities', 'gauge', 'Number of entities', [({}, len(engine.entities))]),
+            ('entities_sleeping', 'gauge', 'Number of sleeping entities', [({}, len(engine.sleeping_entities))]),
+            ('components', 'gauge', 'Number of components by class',
+             [({'class': class_name}, len(components)) for class_name, components in sorted(by_class.items())]),
+            ('component_memory_bytes', 'gauge', 'Estimated memory used by components by class', memory),
+            ('events_published_total', 'counter', 'Number of published events by event id',
+             [({'event': id}, count) for id, count in sorted(EventBus.publish_counts().items())]),
+        ]
+
+
+class MetricsServer(object):
+    """
+    Serves metrics over HTTP on the local address in the background thread
+    """
+
+    def __init__(self, collector, port=9100, host='127.0.0.1'):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = collector.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = HTTPServer((host, port), Handler)
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name='MetricsServer')
+        self.__thread.daemon = True
+        self.__thread.start()
+        metrics_logger.info('Serving metrics on http://{}:{}/'.format(host, self.port))
+
+    @property
+    def port(self):
+        return self.__server.server_address[1]
+
+    def close(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+
+class MetricsFileDumper(object):
+    """
+    Periodically writes metrics to the file in the background thread
+    (e.g. for node_exporter textfile collector)
+    """
+
+    def __init__(self, collector, path, period=10.0):
+        self.__collector = collector
+        self.__path = path
+        self.__period = period
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__work, name='MetricsFileDumper')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def dump(self):
+        # File is replaced at once, so readers never see partial content
+        tmp_path = self.__path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.__collector.render())
+        os.rename(tmp_path, self.__path)
+
+    def close(self):
+        """
+        Stops dumping, final metrics are written
+        """
+        self.__stop.set()
+        self.__thread.join()
+        self.dump()
+
+    def __work(self):
+        while not self.__stop.wait(self.__period):
+            try:
+                self.dump()
+            except (IOError, OSError) as e:
+                metrics_logger.error('Metrics dump failed: {}'.format(e))
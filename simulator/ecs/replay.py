@@ -0,0 +1,373 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Recording of the EventBus traffic and deterministic replay.
+#
+# Log file is the sequence of binary records:
+#   header:  type (uint8), event id (uint16), timestamp (float64), payload size (uint32)
+#   payload: payload size bytes
+# Record types:
+#   RECORD_EVENT        - top-level published event, payload encoded by event encoder
+#   RECORD_NESTED_EVENT - event published by the callback of another event
+#   RECORD_KEYFRAME     - world state (pickled (step, world_state)) taken before
+#                         the update with the given step. First record of the
+#                         log is always keyframe of step 0 - initial world.
+#
+# Replay restores nearest keyframe and calls Engine.update() with the recorded
+# dt values without any clock, so it runs as fast as the systems allow.
+# Top-level events published between the updates are published again in the
+# recorded order, nested events are the results of the replayed ones.
+# Systems should be deterministic (depend only on the world state, dt and events).
+# Changes not passed through the EventBus (e.g. camera moved by the input system)
+# and changes of the world structure between the updates are not reproduced.
+
+import struct
+import time
+import pickle
+import bisect
+import numpy as np
+import simulator.ecs.stdevent as stdevent
+from simulator.ecs.core import EventBus, Engine, Entity, BaseComponent
+from simulator.ecs.serialization import world_state, world_state_diff, restore_world
+import simulator.helpers.log_helper as log_helper
+
+replay_logger = log_helper.getLogger('Replay')
+
+MAGIC = b'KSRL'
+VERSION = 2
+
+RECORD_EVENT = 0
+RECORD_KEYFRAME = 1
+RECORD_NESTED_EVENT = 2
+
+# Sleep and wake of the entity between the updates are replayed by the calls, not by the events
+_replayed_calls = {
+    stdevent.EVENT_ENTITY_SLEEP: Entity.sleep,
+    stdevent.EVENT_ENTITY_WAKE: Entity.wake,
+}
+# Events which are the results of the Engine and Entity calls, they can't be replayed
+_structure_events = {
+    stdevent.EVENT_COMPONENT_ADDED,
+    stdevent.EVENT_COMPONENT_REMOVED,
+    stdevent.EVENT_ENTITY_ADDED,
+    stdevent.EVENT_ENTITY_REMOVED,
+    stdevent.EVENT_SETUP,
+    stdevent.EVENT_TEARDOWN,
+}
+
+_header = struct.Struct('<BHdI')
+_update_payload = struct.Struct('<d')
+
+
+def encode_update(args):
+    """
+    EVENT_UPDATE payload: only dt is stored, Engine is implied
+    """
+    return _update_payload.pack(args[1])
+
+
+def decode_update(payload):
+    return _update_payload.unpack(payload)
+
+
+def _compact_arg(arg):
+    # ECS objects are stored as references by name
+    if isinstance(arg, Engine):
+        return ('engine',)
+    if isinstance(arg, Entity):
+        return ('entity', arg.name)
+    if isinstance(arg, BaseComponent):
+        parent = arg.parent
+        return ('component', parent.name if parent is not None else None, arg.__class__.__name__)
+    if isinstance(arg, (bool, int, float, str, bytes, np.ndarray, np.number)) or arg is None:
+        return arg
+    if isinstance(arg, (tuple, list)):
+        return tuple(_compact_arg(item) for item in arg)
+    return ('object', arg.__class__.__name__)
+
+
+def _resolve_arg(arg, engine, entities):
+    # Reverse of _compact_arg, entities is the lazy filled dictionary {name: entity}
+    if not isinstance(arg, tuple) or not arg:
+        return arg
+    if arg == ('engine',):
+        return engine
+    if len(arg) == 2 and arg[0] == 'entity':
+        return _find_entity(arg[1], engine, entities)
+    if len(arg) == 3 and arg[0] == 'component':
+        entity = _find_entity(arg[1], engine, entities)
+        for component_class, components in entity.components.items():
+            if component_class.__name__ == arg[2] and components:
+                return components[0]
+        raise LookupError('Entity {} has no component {}'.format(arg[1], arg[2]))
+    if len(arg) == 2 and arg[0] == 'object':
+        raise LookupError('Object {} is not stored in the log'.format(arg[1]))
+    return tuple(_resolve_arg(item, engine, entities) for item in arg)
+
+
+def _find_entity(name, engine, entities):
+    if not entities:
+        entities.update((entity.name, entity) for entity in engine.entities)
+    if name not in entities:
+        raise LookupError('No entity {}'.format(name))
+    return entities[name]
+
+
+def encode_default(args):
+    """
+    Default payload: pickled args, ECS objects replaced by their names
+    """
+    return pickle.dumps(tuple(_compact_arg(arg) for arg in args), 2)
+
+
+def decode_default(payload):
+    return pickle.loads(payload)
+
+
+def _without_entities(state, component_classes):
+    # Drops entities having any of the components from the world state
+    return [(name, sleeping, components) for name, sleeping, components in state
+            if not any(issubclass(component_class, component_classes) for component_class, _ in components)]
+
+
+class EventRecorder(object):
+    """
+    Writes every published event to the binary log
+    """
+
+    def __init__(self, path, engine, keyframe_interval=300, encoders=None):
+        """
+        Starts recording, initial world state is written immediately
+        :param path: Log file path
+        :param engine: Engine to record
+        :param keyframe_interval: Number of updates between the keyframes
+        :param encoders: Dictionary {event id: function(args) -> bytes} to override default
+                         payload encoding. Return None to skip payload.
+        """
+        self.__file = open(path, 'wb')
+        self.__file.write(MAGIC + struct.pack('<H', VERSION))
+        self.__engine = engine
+        self.__keyframe_interval = keyframe_interval
+        self.__encoders = {stdevent.EVENT_UPDATE: encode_update}
+        if encoders is not None:
+            self.__encoders.update(encoders)
+        self.__start = time.time()
+        self.__step = 0
+        self.__write_keyframe()
+        EventBus.set_recorder(self.__record)
+        replay_logger.info('Recording to {}'.format(path))
+
+    @property
+    def step(self):
+        return self.__step
+
+    def close(self):
+        """
+        Stops recording
+        """
+        EventBus.set_recorder(None)
+        self.__file.close()
+
+    def __write(self, record_type, id, payload):
+        self.__file.write(_header.pack(record_type, id, time.time() - self.__start, len(payload)))
+        self.__file.write(payload)
+
+    def __write_keyframe(self):
+        self.__write(RECORD_KEYFRAME, 0, pickle.dumps((self.__step, world_state(self.__engine)), 2))
+
+    def __record(self, id, args):
+        if id == stdevent.EVENT_UPDATE:
+            if self.__step > 0 and self.__step % self.__keyframe_interval == 0:
+                self.__write_keyframe()
+            self.__step += 1
+        payload = self.__encoders.get(id, encode_default)(args)
+        record_type = RECORD_EVENT if EventBus.depth() == 0 else RECORD_NESTED_EVENT
+        self.__write(record_type, id, payload if payload is not None else b'')
+
+
+class EventReplayer(object):
+    """
+    Replays recorded log on the Engine
+    """
+
+    def __init__(self, path, decoders=None, skip_ids=(), input_components=()):
+        """
+        Reads the log index: keyframes positions, dt of every update and top-level events
+        :param path: Log file path
+        :param decoders: Dictionary {event id: function(bytes) -> args} used by events() and
+                         to publish events again. ECS objects names are resolved by the replayer.
+        :param skip_ids: Ids of the top-level events which are not published again (e.g. rendering)
+        :param input_components: Component classes of the entities changed only by the user input
+                                 (e.g. camera), such entities are not compared by verify()
+        """
+        self.__path = path
+        self.__decoders = {stdevent.EVENT_UPDATE: decode_update}
+        if decoders is not None:
+            self.__decoders.update(decoders)
+        self.__input_components = tuple(input_components)
+        self.__keyframes = []  # [(step, offset)]
+        self.__events = []  # Top-level events to publish again [(step, offset)], step is the count of updates before
+        dts = []
+        structure_changes = 0
+        with open(path, 'rb') as f:
+            self.__check_header(f)
+            accept = lambda record_type, id: record_type == RECORD_KEYFRAME or id == stdevent.EVENT_UPDATE or \
+                (record_type == RECORD_EVENT and id not in skip_ids)
+            for record_type, id, timestamp, offset, payload in self.__read_records(f, accept):
+                if record_type == RECORD_KEYFRAME:
+                    self.__keyframes.append((len(dts), offset))
+                elif id == stdevent.EVENT_UPDATE:
+                    dts.append(decode_update(payload)[0])
+                elif id in _structure_events:
+                    structure_changes += id not in (stdevent.EVENT_SETUP, stdevent.EVENT_TEARDOWN)
+                else:
+                    self.__events.append((len(dts), offset))
+        self.__dts = np.array(dts)
+        self.__step = None
+        self.__next_event = 0  # Index of the first event not published since the last restored keyframe
+        if not self.__keyframes:
+            raise ValueError('Log has no initial world state')
+        if structure_changes:
+            replay_logger.warning('{} changes of the world structure between the updates '
+                                  'are not reproduced by replay'.format(structure_changes))
+
+    @property
+    def steps(self):
+        """
+        Number of recorded updates
+        """
+        return len(self.__dts)
+
+    @property
+    def step(self):
+        """
+        Number of updates applied to the engine by the last seek, None if never seek
+        """
+        return self.__step
+
+    @property
+    def dts(self):
+        return self.__dts
+
+    def seek(self, engine, step):
+        """
+        Brings the engine to the state before the update with given step.
+        Nearest keyframe is restored, if current step of the engine is not closer.
+        :param engine: Engine with all non-visual systems subscribed
+        :param step: Target step from 0 to steps
+        """
+        if step < 0 or step > self.steps:
+            raise ValueError('Step {} is out of the log range [0, {}]'.format(step, self.steps))
+
+        keyframe_step, offset = max((k for k in self.__keyframes if k[0] <= step), key=lambda k: k[0])
+        if self.__step is None or self.__step > step or self.__step < keyframe_step:
+            self.__restore(engine, offset)
+        self.__advance(engine, step)
+
+    def run(self, engine):
+        """
+        Replays the whole log from the beginning
+        :param engine: Engine with all non-visual systems subscribed
+        """
+        self.__step = None
+        self.seek(engine, self.steps)
+
+    def verify(self, engine):
+        """
+        Checks that the replay started from every keyframe reaches the state of the next keyframe,
+        i.e. seek gives the same world as the continuous replay. Fails when some systems keep
+        the state outside of the components attributes (e.g. in the ext data).
+        Entities with the input components are not compared.
+        :param engine: Engine with all non-visual systems subscribed
+        :return: List of (keyframe step, differences) for the keyframes not reached
+        """
+        failures = []
+        for (step, offset), (next_step, next_offset) in zip(self.__keyframes, self.__keyframes[1:]):
+            self.__restore(engine, offset)
+            self.__advance(engine, next_step)
+            differences = world_state_diff(
+                _without_entities(world_state(engine), self.__input_components),
+                _without_entities(self.__read_keyframe(next_offset)[1], self.__input_components))
+            if differences:
+                replay_logger.warning('Replay from step {} differs from keyframe {}: {}'.format(
+                    step, next_step, '; '.join(differences[:5])))
+                failures.append((next_step, differences))
+        return failures
+
+    def events(self, ids=None):
+        """
+        Iterates over recorded events
+        :param ids: Collection of event ids to read or None to read all
+        :return: Generator of (event id, timestamp, decoded payload)
+        """
+        with open(self.__path, 'rb') as f:
+            self.__check_header(f)
+            accept = lambda record_type, id: record_type in (RECORD_EVENT, RECORD_NESTED_EVENT) and \
+                (ids is None or id in ids)
+            for record_type, id, timestamp, offset, payload in self.__read_records(f, accept):
+                yield id, timestamp, self.__decoders.get(id, decode_default)(payload)
+
+    def __read_keyframe(self, offset):
+        with open(self.__path, 'rb') as f:
+            f.seek(offset)
+            record_type, id, timestamp, size = _header.unpack(f.read(_header.size))
+            return pickle.loads(f.read(size))
+
+    def __restore(self, engine, offset):
+        keyframe_step, state = self.__read_keyframe(offset)
+        restore_world(engine, state)
+        self.__step = keyframe_step
+        # Events recorded before the keyframe are already applied to its state
+        self.__next_event = bisect.bisect_left(self.__events, (keyframe_step, offset))
+
+    # Updates the engine up to the step, events recorded after every update are published again
+    def __advance(self, engine, step):
+        with open(self.__path, 'rb') as f:
+            self.__publish_events(f, engine, self.__step)
+            for i in range(self.__step, step):
+                engine.update(float(self.__dts[i]))
+                self.__publish_events(f, engine, i + 1)
+        self.__step = step
+
+    # Publishes recorded events which were published before the update with the given step
+    def __publish_events(self, f, engine, step):
+        entities = {}
+        while self.__next_event < len(self.__events) and self.__events[self.__next_event][0] <= step:
+            f.seek(self.__events[self.__next_event][1])
+            self.__next_event += 1
+            record_type, id, timestamp, size = _header.unpack(f.read(_header.size))
+            args = self.__decoders.get(id, decode_default)(f.read(size))
+            try:
+                args = [_resolve_arg(arg, engine, entities) for arg in args]
+            except LookupError as e:
+                replay_logger.warning('Event {} at step {} is not replayed: {}'.format(id, step, e))
+                continue
+            if id in _replayed_calls:
+                _replayed_calls[id](*args)
+            else:
+                EventBus.publish(id, *args)
+
+    @staticmethod
+    def __check_header(f):
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not an event log')
+        version, = struct.unpack('<H', f.read(2))
+        if version != VERSION:
+            raise ValueError('Unsupported event log version {}'.format(version))
+
+    # Reads accepted records, payloads of the keyframes are skipped
+    @staticmethod
+    def __read_records(f, accept):
+        while True:
+            offset = f.tell()
+            header = f.read(_header.size)
+            if len(header) < _header.size:
+                return
+            record_type, id, timestamp, size = _header.unpack(header)
+            if not accept(record_type, id):
+                f.seek(size, 1)
+            elif record_type == RECORD_KEYFRAME:
+                f.seek(size, 1)
+                yield record_type, id, timestamp, offset, None
+            else:
+                yield record_type, id, timestamp, offset, f.read(size)
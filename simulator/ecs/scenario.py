@@ -0,0 +1,257 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Scenario file: entities and their components stored by columns.
+#
+# File is the header (MAGIC, version uint16) followed by blocks. Block:
+#   type (uint8), kind (uint8), name (uint16 length + utf-8), arrays count (uint8), arrays
+# Array:
+#   dtype (uint8 length + ascii), ndim (uint8), shape (uint64 * ndim), raw data
+#
+# Entities are written by chunks, every chunk is:
+#   BLOCK_ENTITIES              arrays: names offsets, names utf-8 bytes, sleeping flags
+#   BLOCK_COMPONENT (per class) name: class path, arrays: entity index (in chunk) of every component
+#   BLOCK_FIELD (per attribute) name: attribute, kind: how values are stored (see KIND_*)
+# Loader reads one chunk at a time, so file of any size can be loaded
+# without holding it in the memory.
+
+import struct
+import sys
+import numpy as np
+from simulator.ecs.core import Entity, BaseComponent
+from simulator.ecs.serialization import component_state, restore_component
+
+MAGIC = b'KSCN'
+VERSION = 1
+
+BLOCK_ENTITIES = 0
+BLOCK_COMPONENT = 1
+BLOCK_FIELD = 2
+
+# Field kinds
+KIND_SCALAR = 0   # Python numbers, column (m,)
+KIND_TUPLE = 1    # Tuples/lists of numbers with the same length, column (m, k)
+KIND_ARRAY = 2    # numpy arrays with the same shape, column (m, ...)
+KIND_RAGGED = 3   # numpy arrays with different first dimension: offsets (m+1,) and values (total, ...)
+KIND_STRING = 4   # Strings: offsets (m+1,) and utf-8 bytes
+
+_block_header = struct.Struct('<BBH')
+
+
+def _is_number(value):
+    return isinstance(value, (bool, int, float, np.number))
+
+
+def _encode_strings(values):
+    data = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) for item in data])
+    return [offsets, np.frombuffer(b''.join(data), dtype=np.uint8)]
+
+
+def _decode_strings(offsets, data):
+    data = data.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def _encode_field(name, values):
+    """
+    Chooses field kind and converts values to the column arrays
+    :return: (kind, arrays)
+    """
+    if all(_is_number(value) for value in values):
+        return KIND_SCALAR, [np.array(values)]
+    if all(isinstance(value, str) for value in values):
+        return KIND_STRING, _encode_strings(values)
+    if all(isinstance(value, (tuple, list)) and all(_is_number(item) for item in value) for value in values) and \
+            len(set(len(value) for value in values)) == 1:
+        return KIND_TUPLE, [np.array(values)]
+    if all(isinstance(value, np.ndarray) for value in values):
+        if any(value.dtype.hasobject for value in values):
+            raise ValueError('Field "{}" has object arrays, they can\'t be stored in the scenario'.format(name))
+        if len(set(value.shape for value in values)) == 1:
+            return KIND_ARRAY, [np.stack(values)]
+        if all(value.ndim > 0 for value in values) and len(set(value.shape[1:] for value in values)) == 1:
+            offsets = np.zeros(len(values) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(value) for value in values])
+            return KIND_RAGGED, [offsets, np.concatenate(values)]
+    raise ValueError('Field "{}" can\'t be stored in the scenario'.format(name))
+
+
+def _decode_field(kind, arrays):
+    if kind == KIND_SCALAR:
+        return arrays[0].tolist()
+    if kind == KIND_STRING:
+        return _decode_strings(*arrays)
+    if kind == KIND_TUPLE:
+        return [tuple(row) for row in arrays[0].tolist()]
+    if kind == KIND_ARRAY:
+        return list(arrays[0])
+    if kind == KIND_RAGGED:
+        offsets, data = arrays
+        return [data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+    raise ValueError('Unknown field kind {}'.format(kind))
+
+
+def _class_path(component_class):
+    return '{}.{}'.format(component_class.__module__, component_class.__name__)
+
+
+# Class is looked up only in the already imported modules, file can't make the loader
+# import anything or create objects other than components
+def _load_class(path, cache):
+    if path not in cache:
+        module_name, _, name = path.rpartition('.')
+        module = sys.modules.get(module_name)
+        if module is None:
+            raise ValueError('Module of the component {} is not imported'.format(path))
+        component_class = getattr(module, name, None)
+        if not isinstance(component_class, type) or not issubclass(component_class, BaseComponent):
+            raise ValueError('{} is not a component class'.format(path))
+        cache[path] = component_class
+    return cache[path]
+
+
+def _write_array(f, array):
+    array = np.ascontiguousarray(array)
+    dtype = array.dtype.str.encode('ascii')
+    f.write(struct.pack('<B', len(dtype)) + dtype)
+    f.write(struct.pack('<B', array.ndim))
+    f.write(struct.pack('<{}Q'.format(array.ndim), *array.shape))
+    f.write(array.tobytes())
+
+
+def _read_array(f):
+    size, = struct.unpack('<B', f.read(1))
+    dtype = np.dtype(f.read(size).decode('ascii'))
+    ndim, = struct.unpack('<B', f.read(1))
+    shape = struct.unpack('<{}Q'.format(ndim), f.read(8 * ndim))
+    count = int(np.prod(shape)) if ndim > 0 else 1
+    # Copy makes array writable and independent from the read buffer
+    return np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype).reshape(shape).copy()
+
+
+def _write_block(f, block_type, kind, name, arrays):
+    name = name.encode('utf-8')
+    f.write(_block_header.pack(block_type, kind, len(name)) + name)
+    f.write(struct.pack('<B', len(arrays)))
+    for array in arrays:
+        _write_array(f, array)
+
+
+def _read_block(f):
+    header = f.read(_block_header.size)
+    if len(header) < _block_header.size:
+        return None
+    block_type, kind, size = _block_header.unpack(header)
+    name = f.read(size).decode('utf-8')
+    count, = struct.unpack('<B', f.read(1))
+    return block_type, kind, name, [_read_array(f) for _ in range(count)]
+
+
+def _write_chunk(f, entities):
+    _write_block(f, BLOCK_ENTITIES, KIND_STRING, '',
+                 _encode_strings([entity.name for entity in entities]) +
+                 [np.array([entity.sleeping for entity in entities], dtype=bool)])
+
+    rows = {}  # {component class: [(entity index, component)]}
+    for i, entity in enumerate(entities):
+        for component_class, components in entity.components.items():
+            rows.setdefault(component_class, []).extend((i, component) for component in components)
+
+    for component_class, class_rows in rows.items():
+        _write_block(f, BLOCK_COMPONENT, 0, _class_path(component_class),
+                     [np.array([i for i, component in class_rows], dtype=np.int64)])
+        states = [component_state(component) for i, component in class_rows]
+        fields = set(states[0])
+        for state in states:
+            if set(state) != fields:
+                raise ValueError('Components {} have different fields: {}'.format(
+                    component_class.__name__, ', '.join(sorted(fields.symmetric_difference(state)))))
+        for field in sorted(fields):
+            kind, arrays = _encode_field(field, [state[field] for state in states])
+            _write_block(f, BLOCK_FIELD, kind, field, arrays)
+
+
+def save_scenario(path, engine, chunk_size=4096):
+    """
+    Writes all entities of the Engine to the scenario file
+    :param path: Scenario file path
+    :param engine: Engine
+    :param chunk_size: Count of entities in one chunk
+    """
+    entities = engine.entities
+    with open(path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<H', VERSION))
+        for first in range(0, len(entities), chunk_size):
+            _write_chunk(f, entities[first:first + chunk_size])
+
+
+def iter_scenario(path):
+    """
+    Reads scenario file chunk by chunk.
+    Component classes are resolved only in the already imported modules
+    and should be derived from BaseComponent, otherwise ValueError is raised
+    :param path: Scenario file path
+    :return: Generator of (entities, sleeping flags) lists, components are added to the entities
+    """
+    classes = {}
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a scenario file')
+        version, = struct.unpack('<H', f.read(2))
+        if version != VERSION:
+            raise ValueError('Unsupported scenario version {}'.format(version))
+
+        chunk = None
+        component = None
+        while True:
+            block = _read_block(f)
+            if block is None or block[0] == BLOCK_ENTITIES:
+                if component is not None:
+                    _build_components(chunk[0], *component)
+                    component = None
+                if chunk is not None:
+                    yield chunk
+                if block is None:
+                    return
+                names = _decode_strings(*block[3][:2])
+                chunk = ([Entity(name) for name in names], block[3][2].tolist())
+                continue
+
+            block_type, kind, name, arrays = block
+            if chunk is None:
+                raise ValueError('Scenario block outside of the chunk')
+            if block_type == BLOCK_COMPONENT:
+                if component is not None:
+                    _build_components(chunk[0], *component)
+                component = (_load_class(name, classes), arrays[0], {})
+            elif block_type == BLOCK_FIELD:
+                if component is None:
+                    raise ValueError('Field "{}" outside of the component'.format(name))
+                component[2][name] = _decode_field(kind, arrays)
+            else:
+                raise ValueError('Unknown scenario block {}'.format(block_type))
+
+
+def _build_components(entities, component_class, entity_indices, fields):
+    for row, i in enumerate(entity_indices):
+        state = {name: values[row] for name, values in fields.items()}
+        entities[i].add_component(restore_component(component_class, state))
+
+
+def load_scenario(path, engine):
+    """
+    Adds all entities from the scenario file to the Engine
+    :param path: Scenario file path
+    :param engine: Engine
+    :return: Count of loaded entities
+    """
+    count = 0
+    for entities, sleeping in iter_scenario(path):
+        for entity, entity_sleeping in zip(entities, sleeping):
+            engine.add_entity(entity)
+            if entity_sleeping:
+                entity.sleep()
+        count += len(entities)
+    return count
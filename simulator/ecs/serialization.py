@@ -0,0 +1,113 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Helpers to save and restore state of components and whole world.
+# Component state is the dictionary of its own attributes, parent entity
+# and ext data (renderer sprites, systems temporary data) are not saved.
+
+import copy
+import numpy as np
+from simulator.ecs.core import BaseComponent, Entity
+
+
+def component_state(component):
+    """
+    Gets attributes of the component
+    :param component: Component
+    :return: Dictionary {attribute name: value}, values are not copied
+    """
+    return {name: value for name, value in vars(component).items()
+            if name != 'ext' and not name.startswith('_BaseComponent__')}
+
+
+def restore_component(component_class, state):
+    """
+    Creates component from the attributes without calling its constructor
+    :param component_class: Class of the component
+    :param state: Dictionary {attribute name: value}
+    :return: New component not added to any entity
+    """
+    component = component_class.__new__(component_class)
+    BaseComponent.__init__(component)
+    for name, value in state.items():
+        setattr(component, name, value)
+    return component
+
+
+def world_state(engine):
+    """
+    Copies state of all entities in the Engine
+    :param engine: Engine
+    :return: List of (entity name, sleeping, [(component class, component state)])
+    """
+    return [(entity.name, entity.sleeping,
+             [(component_class, copy.deepcopy(component_state(component)))
+              for component_class, components in entity.components.items()
+              for component in components])
+            for entity in engine.entities]
+
+
+def _values_equal(a, b):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and a.shape == b.shape and \
+            np.array_equal(a, b)
+    if isinstance(a, (tuple, list)) and isinstance(b, (tuple, list)):
+        return len(a) == len(b) and all(_values_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def world_state_diff(a, b):
+    """
+    Compares two world states
+    :param a: World state from world_state()
+    :param b: World state from world_state()
+    :return: List of differences descriptions, empty if states are equal
+    """
+    if len(a) != len(b):
+        return ['{} entities instead of {}'.format(len(a), len(b))]
+    differences = []
+    for (name, sleeping, components), (other_name, other_sleeping, other_components) in zip(a, b):
+        if name != other_name:
+            differences.append('Entity {} instead of {}'.format(name, other_name))
+            continue
+        if sleeping != other_sleeping:
+            differences.append('{}: sleeping {} instead of {}'.format(name, sleeping, other_sleeping))
+        if [cls for cls, state in components] != [cls for cls, state in other_components]:
+            differences.append('{}: different components'.format(name))
+            continue
+        for (component_class, state), (_, other_state) in zip(components, other_components):
+            for field in sorted(set(state) | set(other_state)):
+                if field not in state or field not in other_state or \
+                        not _values_equal(state[field], other_state[field]):
+                    differences.append('{}: {}.{} {!r} instead of {!r}'.format(
+                        name, component_class.__name__, field, state.get(field), other_state.get(field)))
+    return differences
+
+
+def clear_world(engine):
+    """
+    Removes all entities and their components from the Engine
+    :param engine: Engine
+    """
+    for entity in list(engine.entities):
+        for components in list(entity.components.values()):
+            for component in list(components):
+                entity.remove_component(component)
+        engine.remove_entity(entity)
+
+
+def restore_world(engine, state):
+    """
+    Replaces all entities in the Engine by entities from the state.
+    NOTE: visual representation should be recreated after restore
+    :param engine: Engine
+    :param state: World state from world_state()
+    """
+    clear_world(engine)
+    for name, sleeping, components in state:
+        entity = Entity(name)
+        for component_class, component_data in components:
+            entity.add_component(restore_component(component_class, copy.deepcopy(component_data)))
+        engine.add_entity(entity)
+        if sleeping:
+            entity.sleep()
@@ -8,4 +8,6 @@ EVENT_ENTITY_ADDED = 3
 EVENT_ENTITY_REMOVED = 4
 EVENT_UPDATE = 5
 EVENT_SETUP = 6
-EVENT_TEARDOWN = 7
\ No newline at end of file
+EVENT_TEARDOWN = 7
+EVENT_ENTITY_SLEEP = 8
+EVENT_ENTITY_WAKE = 9
@@ -1,4 +1,8 @@
 # This file is licensed under MIT license.
 # See the LICENSE file in the project root for more information.
 
-EVENT_INIT_GRAPHICS = 100
\ No newline at end of file
+EVENT_INIT_GRAPHICS = 100
+EVENT_RENDER = 101  # (engine, alpha)
+EVENT_QUIT = 102
+EVENT_WAKE_AREA = 103  # (pos, radius)
+EVENT_SNAPSHOT = 104  # (engine) after the simulation steps the next EVENT_RENDER interpolates between
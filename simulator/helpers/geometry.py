@@ -0,0 +1,50 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Vectorized geometry helpers.
+# World uses screen coordinates (y axis points down), rotation is in degrees
+# counterclockwise on the screen, the same as pygame.transform.rotate.
+
+import numpy as np
+
+
+def heading(rot):
+    """
+    Gets unit direction vectors of the rotations
+    :param rot: Rotation in degrees, scalar or array (N,)
+    :return: Array (2,) or (N, 2)
+    """
+    rad = np.radians(rot)
+    return np.stack([np.cos(rad), -np.sin(rad)], axis=-1)
+
+
+def normal(rot):
+    """
+    Gets unit vectors perpendicular to the heading (pointing to the right side on the screen)
+    :param rot: Rotation in degrees, scalar or array (N,)
+    :return: Array (2,) or (N, 2)
+    """
+    rad = np.radians(rot)
+    return np.stack([np.sin(rad), np.cos(rad)], axis=-1)
+
+
+def box_edges(pos, rot, size):
+    """
+    Gets edges of the rotated boxes
+    :param pos: Box centers (N, 2)
+    :param rot: Box rotations (N,)
+    :param size: Box sizes (length along heading, width) (N, 2)
+    :return: Edges start and end points, arrays (N, 4, 2)
+    """
+    h = heading(rot) * (np.asarray(size)[:, 0:1] / 2)
+    n = normal(rot) * (np.asarray(size)[:, 1:2] / 2)
+    pos = np.asarray(pos)
+    corners = np.stack([pos + h + n, pos - h + n, pos - h - n, pos + h - n], axis=1)
+    return corners, np.roll(corners, -1, axis=1)
+
+
+def cross(a, b):
+    """
+    2D cross product of the vectors arrays (..., 2)
+    """
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
@@ -3,10 +3,12 @@
 
 # This is a helper to do more fancy logging
 #
-# Importing this file will automatically setup root logger:
+# Call setupRootLogger() once in the application to setup root logger:
 # - logging to stdout
 # - debug level
 # - fancy colored format
+# Importing this file doesn't change logging configuration, loggers created
+# with getLogger() have no own handlers and log through the root logger.
 #
 # Use log_helper.getLogger() instead of logging.getLogger() to create new loggers
 
@@ -14,7 +16,6 @@ import logging
 import sys
 
 _max_name_length = 0
-__registered_loggers = []
 
 class FacnyFormatter(logging.Formatter):
     __levels = {
@@ -28,13 +29,15 @@ class FacnyFormatter(logging.Formatter):
 
     def format(self, record):
         if record.name == 'root':
-            return '{}   {}   {}'.format(FacnyFormatter.__levels[record.levelno], str.ljust(' ', _max_name_length), record.msg + '\033[0m')
+            return '{}   {}   {}'.format(FacnyFormatter.__levels[record.levelno], str.ljust(' ', _max_name_length), record.getMessage() + '\033[0m')
         else:
-            return '{}  [{}]  {}'.format(FacnyFormatter.__levels[record.levelno], str.ljust(record.name, _max_name_length), record.msg + '\033[0m')
+            return '{}  [{}]  {}'.format(FacnyFormatter.__levels[record.levelno], str.ljust(record.name, _max_name_length), record.getMessage() + '\033[0m')
 
 
-def setupLogger(logger):
-    logger.setLevel(logging.DEBUG)
+def setupLogger(logger, level=None):
+    # Without the level logger follows the root logger level
+    if level is not None:
+        logger.setLevel(level)
     handler = logging.StreamHandler(sys.stdout)
     handler.setFormatter(FacnyFormatter())
     logger.handlers = [handler]
@@ -42,19 +45,16 @@ def setupLogger(logger):
 
 
 def getLogger(name):
+    # Plain logger, its messages are passed to the root logger handlers.
+    # Name is only remembered to align names in the fancy format
     global _max_name_length
-    logger = logging.getLogger(name)
-    if logger not in __registered_loggers:
-        _max_name_length = max(_max_name_length, len(name))
-        setupLogger(logger)
-        __registered_loggers.append(logger)
-    return logger
+    _max_name_length = max(_max_name_length, len(name))
+    return logging.getLogger(name)
 
 
 def setLevel(logger, level):
-    logger = logging.getLogger(logger)
-    logger.handlers[0].setLevel(level)
+    logging.getLogger(logger).setLevel(level)  # Messages below the level are not even formatted
 
 
-# Setup root logger
-setupLogger(logging.getLogger())
+def setupRootLogger(level=logging.DEBUG):
+    setupLogger(logging.getLogger(), level)
@@ -0,0 +1,294 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Road geometry.
+# Road is the polyline of the center points with even count of lanes on
+# the both sides. Lanes boundaries are offset polylines joined with miter
+# at every point (same as create_road in research/road_opengl.py).
+
+import numpy as np
+
+
+def _check_road(points, lines_cnt, lines_width):
+    if len(points) < 2:
+        raise ValueError('Road should contains at least two points')
+
+    if lines_cnt % 2 != 0:
+        raise ValueError('Odd lines count not supported')
+
+    if lines_width <= 0:
+        raise ValueError('Lines width should be greater then zero')
+
+
+def lane_offsets(lines_cnt, lines_width):
+    """
+    Gets offsets of the lanes boundaries from the center line
+    :return: Array (lines_cnt+1,)
+    """
+    return np.arange(-(lines_cnt // 2), lines_cnt // 2 + 1) * float(lines_width)
+
+
+def miter_vectors(points, indices=None):
+    """
+    Gets the vectors joining boundary points at the road points:
+    boundary point with offset o is points[i] + o * miter[i].
+    Miter at the point depends only on the point and its neighbours
+    :param points: Road center points (P, 2)
+    :param indices: Indices of the points or None for all points
+    :return: Array (P, 2) or (len(indices), 2)
+    """
+    points = np.asarray(points, dtype=float)
+    if indices is None:
+        indices = np.arange(len(points))
+    indices = np.asarray(indices)
+
+    # Normals of the segments before and after the point (the same segment at the ends)
+    prev_seg = np.clip(indices - 1, 0, len(points) - 2)
+    next_seg = np.clip(indices, 0, len(points) - 2)
+    n1 = _segment_normals(points, prev_seg)
+    n2 = _segment_normals(points, next_seg)
+
+    # Bisector scaled to keep the lanes width on the both sides
+    nb = (n1 + n2) / 2
+    return nb / np.sum(nb * n1, axis=1, keepdims=True)
+
+
+def _segment_normals(points, segments):
+    v = points[segments + 1] - points[segments]
+    v /= np.linalg.norm(v, axis=1, keepdims=True)
+    return np.stack([-v[:, 1], v[:, 0]], axis=1)
+
+
+def road_boundaries(points, lines_cnt, lines_width):
+    """
+    Gets polylines of the lanes boundaries.
+    Support only even count of lines
+    :param points: Road center points (P, 2)
+    :param lines_cnt: Count of the lanes
+    :param lines_width: Width of the lane
+    :return: Array (lines_cnt+1, P, 2)
+    """
+    _check_road(points, lines_cnt, lines_width)
+    offsets = lane_offsets(lines_cnt, lines_width)
+    return np.asarray(points, dtype=float)[None, :, :] + offsets[:, None, None] * miter_vectors(points)[None, :, :]
+
+
+def boundary_segments(points, lines_cnt, lines_width):
+    """
+    Gets all segments of the lanes boundaries
+    :return: Segments start and end points, arrays ((lines_cnt+1) * (P-1), 2)
+    """
+    boundaries = road_boundaries(points, lines_cnt, lines_width)
+    return boundaries[:, :-1].reshape(-1, 2), boundaries[:, 1:].reshape(-1, 2)
+
+
+####################################################
+# Triangulation
+
+vertex_dtype = [('pos', np.float32, (2,)),
+                ('color', np.ubyte)]
+
+
+def lane_colors(lines_cnt):
+    """
+    Gets colors (lane ids) of the lanes, same as create_colors in research/road_opengl.py
+    :return: Array (lines_cnt,)
+    """
+    rng = np.arange(lines_cnt // 2)
+    return np.concatenate([10 + rng[::-1] + 1, rng + 1]).astype(np.ubyte)
+
+
+def triangulate_segments(cur_points, next_points, colors):
+    """
+    Triangulates road segments, every lane of the segment is two triangles:
+    (P1, P2, O1) and (O1, P2, O2), where P - start section points and O - end section points
+    :param cur_points: Sections at the segments start (K, lines_cnt+1, 2)
+    :param next_points: Sections at the segments end (K, lines_cnt+1, 2)
+    :param colors: Lanes colors (lines_cnt,)
+    :return: Vertices (K, lines_cnt*6) of vertex_dtype
+    """
+    p1, p2 = cur_points[:, :-1], cur_points[:, 1:]
+    o1, o2 = next_points[:, :-1], next_points[:, 1:]
+    pos = np.stack([p1, p2, o1, o1, p2, o2], axis=2)  # (K, lines_cnt, 6, 2)
+
+    vertices = np.empty(pos.shape[:3], dtype=vertex_dtype)
+    vertices['pos'] = pos
+    vertices['color'] = np.asarray(colors)[None, :, None]
+    return vertices.reshape(len(cur_points), -1)
+
+
+class RoadNetwork(object):
+    """
+    Road network with incremental triangulation.
+    Every road segment owns fixed range of vertices (slot) in the preallocated
+    vertex buffer. Changing the point re-triangulates only the segments which
+    sections depend on it (the point's segments and their miter neighbours),
+    and patches their slots in place. Roads (e.g. road tiles) can be streamed
+    in and out: removed road slots are cleared and reused by the new roads.
+    """
+
+    def __init__(self, lines_cnt, lines_width, capacity=1024):
+        """
+        :param lines_cnt: Count of the lanes of every road
+        :param lines_width: Width of the lane
+        :param capacity: Initial count of the segments slots
+        """
+        _check_road(np.zeros((2, 2)), lines_cnt, lines_width)
+        self.__offsets = lane_offsets(lines_cnt, lines_width)
+        self.__colors = lane_colors(lines_cnt)
+        self.__segment_vertices = lines_cnt * 6
+        self.__vertices = np.zeros(capacity * self.__segment_vertices, dtype=vertex_dtype)
+        self.__free = list(range(capacity - 1, -1, -1))
+        self.__roads = {}    # {road id: (points, slots)}
+        self.__dirty = {}    # {road id: set of segments}
+        self.__cleared = []  # Slots of removed roads not reported yet
+        self.__reallocated = False
+
+    @property
+    def vertices(self):
+        """
+        Vertex buffer. Slots of removed roads and never used slots contain degenerate triangles
+        """
+        return self.__vertices
+
+    @property
+    def segment_vertices(self):
+        """
+        Count of vertices of one segment
+        """
+        return self.__segment_vertices
+
+    @property
+    def roads(self):
+        return list(self.__roads)
+
+    def points(self, road_id):
+        """
+        Gets center points of the road. DO NOT MODIFY, use move_point/set_points
+        """
+        return self.__roads[road_id][0]
+
+    def segment_range(self, road_id, segment):
+        """
+        Gets range of the segment vertices in the vertex buffer
+        :return: (start, stop)
+        """
+        start = self.__roads[road_id][1][segment] * self.__segment_vertices
+        return start, start + self.__segment_vertices
+
+    def add_road(self, road_id, points):
+        """
+        Adds road, all its segments are triangulated on the next update
+        :param road_id: Any hashable id
+        :param points: Road center points (P, 2)
+        """
+        if road_id in self.__roads:
+            raise RuntimeError('Road {} already added'.format(road_id))
+        points = np.array(points, dtype=float)
+        _check_road(points, 2, 1)
+        segments = len(points) - 1
+        if segments > len(self.__free):
+            self.__grow(segments - len(self.__free))
+        slots = np.array([self.__free.pop() for _ in range(segments)])
+        self.__roads[road_id] = (points, slots)
+        self.__dirty[road_id] = set(range(segments))
+
+    def remove_road(self, road_id):
+        """
+        Removes road, its vertices are cleared on the next update
+        :param road_id: Road id
+        """
+        if road_id not in self.__roads:
+            raise RuntimeError('Road {} not in the network'.format(road_id))
+        points, slots = self.__roads.pop(road_id)
+        self.__dirty.pop(road_id, None)
+        self.__cleared.extend(slots)
+
+    def move_point(self, road_id, index, pos):
+        """
+        Moves one center point of the road
+        :param road_id: Road id
+        :param index: Index of the point
+        :param pos: New position (x, y)
+        """
+        points = self.__roads[road_id][0]
+        points[index] = pos
+        self.__mark_dirty(road_id, [index])
+
+    def set_points(self, road_id, points):
+        """
+        Replaces center points of the road keeping their count, only changed points
+        cause re-triangulation
+        :param road_id: Road id
+        :param points: New center points (P, 2)
+        """
+        old_points = self.__roads[road_id][0]
+        points = np.asarray(points, dtype=float)
+        if points.shape != old_points.shape:
+            raise ValueError('Points count can\'t be changed, remove and add the road instead')
+        changed = np.nonzero(np.any(points != old_points, axis=1))[0]
+        old_points[:] = points
+        self.__mark_dirty(road_id, changed)
+
+    def update(self):
+        """
+        Triangulates changed segments and patches the vertex buffer
+        :return: List of changed vertex ranges [(start, stop)], sorted and merged
+        """
+        if self.__reallocated:
+            ranges = [(0, len(self.__vertices))]
+        else:
+            ranges = []
+
+        slots = list(self.__cleared)
+        self.__vertices.reshape(-1, self.__segment_vertices)[self.__cleared] = np.zeros(1, dtype=vertex_dtype)
+        self.__cleared = []
+        self.__free.extend(slots)
+
+        for road_id, segments in self.__dirty.items():
+            if not segments:
+                continue
+            points, road_slots = self.__roads[road_id]
+            segments = np.array(sorted(segments))
+            # Sections are computed for every needed point once
+            indices = np.union1d(segments, segments + 1)
+            sections = points[indices][:, None, :] + self.__offsets[None, :, None] * \
+                miter_vectors(points, indices)[:, None, :]
+            cur_points = sections[np.searchsorted(indices, segments)]
+            next_points = sections[np.searchsorted(indices, segments + 1)]
+            self.__vertices.reshape(-1, self.__segment_vertices)[road_slots[segments]] = \
+                triangulate_segments(cur_points, next_points, self.__colors)
+            slots.extend(road_slots[segments])
+        self.__dirty = {road_id: set() for road_id in self.__roads}
+
+        if not self.__reallocated:
+            ranges = self.__merge_ranges(slots)
+        self.__reallocated = False
+        return ranges
+
+    def __mark_dirty(self, road_id, indices):
+        # Sections of the points index-1..index+1 depend on the point,
+        # so segments from index-2 to index+1 are affected
+        segments_cnt = len(self.__roads[road_id][0]) - 1
+        dirty = self.__dirty.setdefault(road_id, set())
+        for index in indices:
+            dirty.update(range(max(0, index - 2), min(segments_cnt, index + 2)))
+
+    def __grow(self, slots):
+        old_capacity = len(self.__vertices) // self.__segment_vertices
+        capacity = max(old_capacity * 2, old_capacity + slots)
+        vertices = np.zeros(capacity * self.__segment_vertices, dtype=vertex_dtype)
+        vertices[:len(self.__vertices)] = self.__vertices
+        self.__vertices = vertices
+        self.__free = list(range(capacity - 1, old_capacity - 1, -1)) + self.__free
+        self.__reallocated = True
+
+    def __merge_ranges(self, slots):
+        ranges = []
+        for slot in sorted(set(int(slot) for slot in slots)):
+            start = slot * self.__segment_vertices
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], start + self.__segment_vertices)
+            else:
+                ranges.append((start, start + self.__segment_vertices))
+        return ranges
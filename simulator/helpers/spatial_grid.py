@@ -0,0 +1,108 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Uniform grid spatial index.
+# Items are stored in the square cells by their positions, so the items
+# inside some rectangle can be found by visiting only overlapped cells.
+
+import math
+
+
+class SpatialGrid(object):
+    """
+    Spatial hash of the items positions
+    """
+
+    def __init__(self, cell_size):
+        if cell_size <= 0:
+            raise ValueError('Cell size should be greater then zero')
+        self.__cell_size = float(cell_size)
+        self.__cells = {}
+        self.__items = {}
+
+    @property
+    def cell_size(self):
+        return self.__cell_size
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, item):
+        return item in self.__items
+
+    def cell_of(self, pos):
+        """
+        Gets the cell index of the position
+        :param pos: Position (x, y)
+        :return: Tuple of cell indices
+        """
+        return (int(math.floor(pos[0] / self.__cell_size)),
+                int(math.floor(pos[1] / self.__cell_size)))
+
+    def update(self, item, pos):
+        """
+        Inserts item or moves it to the new position
+        :param item: Any hashable object
+        :param pos: Position (x, y)
+        """
+        cell = self.cell_of(pos)
+        old_cell = self.__items.get(item)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self.__discard(item, old_cell)
+        self.__items[item] = cell
+        self.__cells.setdefault(cell, set()).add(item)
+
+    def remove(self, item):
+        """
+        Removes item from the grid
+        :param item: Item to remove
+        """
+        if item not in self.__items:
+            raise RuntimeError('Item not in the grid')
+        self.__discard(item, self.__items.pop(item))
+
+    def clear(self):
+        self.__cells = {}
+        self.__items = {}
+
+    def query(self, min_pos, max_pos):
+        """
+        Gets items from the cells overlapped by rectangle.
+        Items are filtered by cells only, so some items can be slightly
+        outside of the rectangle (but not further then one cell)
+        :param min_pos: Minimal corner of the rectangle (x, y)
+        :param max_pos: Maximal corner of the rectangle (x, y)
+        :return: List of items
+        """
+        x0, y0 = self.cell_of(min_pos)
+        x1, y1 = self.cell_of(max_pos)
+        result = []
+        # Iterate over the smaller of the two: rectangle cells or occupied cells
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(self.__cells):
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    cell = self.__cells.get((x, y))
+                    if cell:
+                        result.extend(cell)
+        else:
+            for (x, y), cell in self.__cells.items():
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    result.extend(cell)
+        return result
+
+    def query_radius(self, pos, radius):
+        """
+        Gets items from the cells overlapped by the circle bounding box
+        :param pos: Center of the circle
+        :param radius: Radius of the circle
+        :return: List of items
+        """
+        return self.query((pos[0] - radius, pos[1] - radius), (pos[0] + radius, pos[1] + radius))
+
+    def __discard(self, item, cell):
+        items = self.__cells[cell]
+        items.discard(item)
+        if not items:
+            del self.__cells[cell]
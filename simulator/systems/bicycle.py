@@ -0,0 +1,87 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Kinematic bicycle model of the vehicles.
+#
+# State of the vehicle: position of the center (x, y), heading psi and speed v.
+# Inputs (ControlComponent): acc[0] - longitudinal acceleration, steer - front
+# wheel angle in degrees. Center is in the middle of the wheelbase L:
+#   beta = atan(tan(steer) / 2)     slip angle of the center
+#   x'   = v * cos(psi + beta)
+#   y'   = -v * sin(psi + beta)     screen coordinates, y axis points down
+#   psi' = 2 * v / L * sin(beta)
+#   v'   = acc[0]
+# All vehicles are integrated together with classic Runge-Kutta 4.
+
+import numpy as np
+from simulator.components.components import PositionComponent, ControlComponent, KinematicComponent
+from simulator.helpers.geometry import heading
+
+
+def bicycle_derivative(state, acc, beta, wheelbase):
+    """
+    Derivative of the vehicles states
+    :param state: Array (N, 4) of [x, y, psi (radians), v]
+    :param acc: Longitudinal accelerations (N,)
+    :param beta: Slip angles in radians (N,)
+    :param wheelbase: Wheelbases (N,)
+    :return: Array (N, 4)
+    """
+    course = state[:, 2] + beta
+    v = state[:, 3]
+    return np.stack([v * np.cos(course),
+                     -v * np.sin(course),
+                     2 * v / wheelbase * np.sin(beta),
+                     acc], axis=1)
+
+
+def bicycle_step(state, acc, steer, wheelbase, dt):
+    """
+    Integrates vehicles states over dt with RK4, inputs are constant during the step
+    :param state: Array (N, 4) of [x, y, psi (radians), v]
+    :param acc: Longitudinal accelerations (N,)
+    :param steer: Steering angles in radians (N,)
+    :param wheelbase: Wheelbases (N,)
+    :param dt: Time step
+    :return: New states (N, 4) and slip angles (N,)
+    """
+    beta = np.arctan(np.tan(steer) / 2)
+    k1 = bicycle_derivative(state, acc, beta, wheelbase)
+    k2 = bicycle_derivative(state + k1 * (dt / 2), acc, beta, wheelbase)
+    k3 = bicycle_derivative(state + k2 * (dt / 2), acc, beta, wheelbase)
+    k4 = bicycle_derivative(state + k3 * dt, acc, beta, wheelbase)
+    return state + (k1 + 2 * k2 + 2 * k3 + k4) * (dt / 6), beta
+
+
+def bicycle_system(state, dt):
+    """
+    Moves all active vehicles with the kinematic bicycle model.
+    KinematicComponent.speed is kept as world velocity vector of the center
+    """
+    controls = state.get_active_components_by_class(ControlComponent)
+    if not controls:
+        return
+
+    positions = [control_cmp.parent.get_first_component_by_class(PositionComponent) for control_cmp in controls]
+    kinematics = [control_cmp.parent.get_first_component_by_class(KinematicComponent) for control_cmp in controls]
+
+    pos = np.array([position_cmp.pos for position_cmp in positions], dtype=float)
+    rot = np.array([position_cmp.rot for position_cmp in positions], dtype=float)
+    speed = np.array([kinematic_cmp.speed for kinematic_cmp in kinematics], dtype=float)
+    # Speed vector is directed along the course, its sign is taken from the heading
+    v = np.linalg.norm(speed, axis=1) * np.where(np.sum(speed * heading(rot), axis=1) < 0, -1.0, 1.0)
+
+    vehicles = np.column_stack([pos, np.radians(rot), v])
+    acc = np.array([control_cmp.acc[0] for control_cmp in controls], dtype=float)
+    steer = np.radians([control_cmp.steer for control_cmp in controls])
+    wheelbase = np.array([kinematic_cmp.wheelbase for kinematic_cmp in kinematics], dtype=float)
+
+    vehicles, beta = bicycle_step(vehicles, acc, steer, wheelbase, dt)
+    rot = np.degrees(vehicles[:, 2])
+    speed = vehicles[:, 3:4] * heading(rot + np.degrees(beta))
+
+    # Rows are copied, views would keep the whole batch alive while the car sleeps
+    for i, (position_cmp, kinematic_cmp) in enumerate(zip(positions, kinematics)):
+        position_cmp.pos = vehicles[i, 0:2].copy()
+        position_cmp.rot = rot[i]
+        kinematic_cmp.speed = speed[i].copy()
@@ -0,0 +1,371 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Virtual lidar.
+# Every RangeSensorComponent casts its rays against lanes boundaries of all
+# roads and boxes of all cars. Rays of all cars are intersected with
+# segments in one vectorized batch; candidate (ray, segment) pairs are
+# selected with uniform grid - only pairs sharing some grid cell are tested.
+# Segments are put into all cells of their bounding boxes, rays only into
+# the cells they cross (DDA traversal).
+#
+# Ranges of the sleeping cars are kept up to date too. Sleeping cars don't
+# move, so their ranges can change only when some moving car gets close:
+# they are recomputed when the car falls asleep and then only for the cars
+# near the moving ones. Changed ranges wake the car up.
+
+import numpy as np
+import simulator.ecs.stdevent as stdevent
+from simulator.ecs.core import EventBus
+from simulator.components.components import PositionComponent, KinematicComponent, RoadComponent, \
+    RangeSensorComponent
+from simulator.helpers.geometry import heading, box_edges, cross
+from simulator.helpers.road import boundary_segments
+
+# Size of the grid cell used for the candidates selection
+GRID_CELL_SIZE = 100.0
+
+# Owner of the road segments
+ROAD_OWNER = -1
+
+# Owner of the rays of the sensors not attached to cars
+NO_OWNER = ROAD_OWNER - 1
+
+
+def _road_segments(road_cmp):
+    # Roads are static, segments are cached in ext until the road geometry is assigned
+    # (RoadComponent drops the derived data then)
+    derived = road_cmp.ext.derived
+    if 'segments' not in derived:
+        derived['segments'] = boundary_segments(road_cmp.points, road_cmp.lines_cnt, road_cmp.lines_width)
+    return derived['segments']
+
+
+def _cell_keys(cx, cy):
+    return (cx << 32) + (cy & 0xffffffff)
+
+
+def _box_cells(box_min, box_max, cell_size):
+    """
+    Gets grid cells overlapped by the boxes
+    :return: (box index, cell key) for every overlapped cell
+    """
+    c0 = np.floor(box_min / cell_size).astype(np.int64)
+    c1 = np.floor(box_max / cell_size).astype(np.int64)
+    n = c1 - c0 + 1
+    counts = n[:, 0] * n[:, 1]
+    item = np.repeat(np.arange(len(counts)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    ny = n[item, 1]
+    return item, _cell_keys(c0[item, 0] + local // ny, c0[item, 1] + local % ny)
+
+
+def _ray_cells(ray_start, ray_end, cell_size):
+    """
+    Gets grid cells crossed by the rays.
+    Crossings of the cells boundaries are ordered along every ray, and
+    every crossing moves to the next cell by one axis (DDA traversal)
+    :return: (ray index, cell key) for every crossed cell
+    """
+    c0 = np.floor(ray_start / cell_size).astype(np.int64)
+    c1 = np.floor(ray_end / cell_size).astype(np.int64)
+    sign = np.sign(c1 - c0)
+    steps = np.abs(c1 - c0)
+    delta = ray_end - ray_start
+
+    # Boundaries crossings of both axes: ray, fraction of the ray and step
+    rays, fractions, moves = [], [], []
+    for axis in range(2):
+        ray = np.repeat(np.arange(len(steps)), steps[:, axis])
+        k = np.arange(len(ray)) - np.repeat(np.cumsum(steps[:, axis]) - steps[:, axis], steps[:, axis])
+        boundary = (c0[ray, axis] + sign[ray, axis] * k + (sign[ray, axis] > 0)) * cell_size
+        rays.append(ray)
+        fractions.append((boundary - ray_start[ray, axis]) / delta[ray, axis])
+        move = np.zeros((len(ray), 2), dtype=np.int64)
+        move[:, axis] = sign[ray, axis]
+        moves.append(move)
+    ray = np.concatenate(rays)
+    order = np.lexsort((np.concatenate(fractions), ray))
+    ray = ray[order]
+    offset = np.cumsum(np.concatenate(moves)[order], axis=0)
+    # Offsets are accumulated over all rays, so the sum of the previous rays is subtracted
+    counts = steps.sum(axis=1)
+    first = np.cumsum(counts) - counts
+    before = np.vstack([np.zeros((1, 2), dtype=np.int64), offset])[first]
+    cells = c0[ray] + offset - before[ray]
+
+    item = np.concatenate([np.arange(len(c0)), ray])
+    return item, _cell_keys(np.concatenate([c0[:, 0], cells[:, 0]]), np.concatenate([c0[:, 1], cells[:, 1]]))
+
+
+def _join_cells(item_a, keys_a, item_b, keys_b):
+    """
+    Finds pairs of items sharing grid cell
+    :return: Arrays of items a and items b, pair is repeated for every shared cell
+    """
+    order = np.argsort(keys_b, kind='mergesort')
+    keys_b = keys_b[order]
+    item_b = item_b[order]
+    lo = np.searchsorted(keys_b, keys_a, 'left')
+    counts = np.searchsorted(keys_b, keys_a, 'right') - lo
+    pair_a = np.repeat(item_a, counts)
+    pair_b = item_b[np.repeat(lo - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())]
+    return pair_a, pair_b
+
+
+def cast_rays(origins, directions, max_ranges, ray_owners, seg_start, seg_end, seg_owners,
+              cell_size=GRID_CELL_SIZE):
+    """
+    Intersects rays with segments. Ray doesn't hit segments with the same owner
+    :param origins: Rays origins (R, 2)
+    :param directions: Rays unit directions (R, 2)
+    :param max_ranges: Rays lengths (R,)
+    :param ray_owners: Rays owners (R,)
+    :param seg_start: Segments start points (S, 2)
+    :param seg_end: Segments end points (S, 2)
+    :param seg_owners: Segments owners (S,)
+    :param cell_size: Grid cell size
+    :return: Distance to the nearest hit or max range for every ray (R,)
+    """
+    ranges = np.array(max_ranges, dtype=float)
+    if len(origins) == 0 or len(seg_start) == 0:
+        return ranges
+
+    # Ray and segment sharing several cells are tested several times, minimum is the same
+    ray_item, ray_keys = _ray_cells(origins, origins + directions * ranges[:, None], cell_size)
+    seg_item, seg_keys = _box_cells(np.minimum(seg_start, seg_end), np.maximum(seg_start, seg_end), cell_size)
+    ray_i, seg_i = _join_cells(ray_item, ray_keys, seg_item, seg_keys)
+    own = ray_owners[ray_i] == seg_owners[seg_i]
+    ray_i = ray_i[~own]
+    seg_i = seg_i[~own]
+
+    d = directions[ray_i]
+    e = seg_end[seg_i] - seg_start[seg_i]
+    w = seg_start[seg_i] - origins[ray_i]
+    denom = cross(d, e)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = cross(w, e) / denom
+        u = cross(w, d) / denom
+    hit = (denom != 0) & (t >= 0) & (u >= 0) & (u <= 1) & (t < ranges[ray_i])
+    np.minimum.at(ranges, ray_i[hit], t[hit])
+    return ranges
+
+
+def _near_points(points, centers, reach):
+    """
+    Finds points closer than reach to any of the centers (checked by the grid cells only)
+    :return: Sorted indices of the points
+    """
+    if len(points) == 0 or len(centers) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # With the cell of two reaches every center box overlaps at most 2x2 cells
+    cell_size = 2.0 * reach
+    c = np.floor(points / cell_size).astype(np.int64)
+    center_item, center_keys = _box_cells(centers - reach, centers + reach, cell_size)
+    point_i, _ = _join_cells(np.arange(len(points)), _cell_keys(c[:, 0], c[:, 1]), center_item, center_keys)
+    return np.unique(point_i)
+
+
+def _car_boxes(kinematics):
+    """
+    Gets boxes of the cars
+    :return: Centers (N, 2), edges start and end points (N, 4, 2), half diagonals (N,)
+    """
+    if not kinematics:
+        return np.zeros((0, 2)), np.zeros((0, 4, 2)), np.zeros((0, 4, 2)), np.zeros(0)
+    positions = [kinematic_cmp.parent.get_first_component_by_class(PositionComponent)
+                 for kinematic_cmp in kinematics]
+    pos = np.array([position_cmp.pos for position_cmp in positions], dtype=float)
+    rot = np.array([position_cmp.rot for position_cmp in positions], dtype=float)
+    size = np.array([kinematic_cmp.size for kinematic_cmp in kinematics], dtype=float)
+    start, end = box_edges(pos, rot, size)
+    return pos, start, end, np.hypot(size[:, 0], size[:, 1]) / 2
+
+
+def _sensor_rays(sensors, owners):
+    """
+    Gets rays of the sensors
+    :param sensors: List of RangeSensorComponents
+    :param owners: Dictionary {entity: owner index}
+    :return: Sensors positions (S, 2), rays counts (S,) and rays origins (R, 2), directions (R, 2),
+             max ranges (R,), owners (R,)
+    """
+    positions = [sensor_cmp.parent.get_first_component_by_class(PositionComponent) for sensor_cmp in sensors]
+    pos = np.array([position_cmp.pos for position_cmp in positions], dtype=float).reshape(-1, 2)
+    rot = np.array([position_cmp.rot for position_cmp in positions], dtype=float)
+    rays = np.array([sensor_cmp.rays for sensor_cmp in sensors], dtype=np.int64)
+    fov = np.array([sensor_cmp.fov for sensor_cmp in sensors], dtype=float)
+    max_range = np.array([sensor_cmp.max_range for sensor_cmp in sensors], dtype=float)
+    sensor_owners = np.array([owners.get(sensor_cmp.parent, NO_OWNER) for sensor_cmp in sensors], dtype=np.int64)
+
+    # Angles offsets are computed once for every (rays, fov) pair and broadcast to all such sensors
+    angles = np.zeros(rays.sum())
+    first = np.cumsum(rays) - rays
+    types, inverse = np.unique(np.column_stack([rays, fov]), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    for i, (count, type_fov) in enumerate(types):
+        count = int(count)
+        if count == 0:
+            continue
+        if type_fov >= 360:
+            offsets = np.linspace(-180.0, 180.0, count, endpoint=False)
+        else:
+            offsets = np.linspace(-type_fov / 2.0, type_fov / 2.0, count)
+        group = np.flatnonzero(inverse == i)
+        angles[first[group][:, None] + np.arange(count)] = rot[group][:, None] + offsets[None, :]
+
+    return pos, rays, np.repeat(pos, rays, axis=0), heading(angles), np.repeat(max_range, rays), \
+        np.repeat(sensor_owners, rays)
+
+
+class RangeSensorSystem(object):
+    """
+    Updates ranges of all RangeSensorComponents.
+    Boxes and sensors of the sleeping entities are cached in the slots,
+    entities falling asleep are added on the next update, woken up
+    entities just free their slots.
+    """
+
+    def __init__(self):
+        self.__pending = {}  # Entities fallen asleep since the last update, dictionary keeps the order
+        self.__reset = False  # Components of the sleeping entity removed, cache should be rebuilt
+        self.__clear()
+        self.__moved = (np.zeros((0, 2)), np.zeros(0))  # Active cars centers and half diagonals of the last update
+
+        EventBus.subscribe(stdevent.EVENT_ENTITY_SLEEP, self.__entity_sleep)
+        EventBus.subscribe(stdevent.EVENT_ENTITY_WAKE, self.__entity_wake)
+        EventBus.subscribe(stdevent.EVENT_ENTITY_REMOVED, self.__entity_wake)
+        EventBus.subscribe(stdevent.EVENT_COMPONENT_REMOVED, self.__component_removed)
+        EventBus.subscribe(stdevent.EVENT_UPDATE, self.__update)
+
+    def __clear(self):
+        self.__car_slots = {}  # {entity: slot}
+        self.__car_centers = np.zeros((0, 2))
+        self.__car_radius = np.zeros(0)
+        self.__car_start = np.zeros((0, 4, 2))
+        self.__car_end = np.zeros((0, 4, 2))
+        self.__car_alive = np.zeros(0, dtype=bool)
+        self.__sensors = []  # Sensor by slot
+        self.__sensor_slots = {}  # {entity: [slots]}
+        self.__sensor_origins = np.zeros((0, 2))
+        self.__sensor_alive = np.zeros(0, dtype=bool)
+        self.__max_range = 0.0
+
+    def __entity_sleep(self, entity):
+        self.__pending[entity] = None
+
+    def __entity_wake(self, entity):
+        self.__pending.pop(entity, None)
+        slot = self.__car_slots.pop(entity, None)
+        if slot is not None:
+            self.__car_alive[slot] = False
+        for slot in self.__sensor_slots.pop(entity, []):
+            self.__sensor_alive[slot] = False
+
+    def __component_removed(self, component):
+        self.__reset = True
+
+    def __add_pending(self, state):
+        """
+        Adds entities fallen asleep to the cache
+        :return: Slots of the added sensors
+        """
+        if self.__reset or len(self.__car_alive) > 2 * len(self.__car_slots) + 1024:
+            # Rebuilt from scratch, dead slots are dropped
+            self.__reset = False
+            self.__clear()
+            self.__pending = dict.fromkeys(entity for entity in state.entities if entity.sleeping)
+        entities = [entity for entity in self.__pending if entity.sleeping]
+        self.__pending = {}
+
+        kinematics = [entity.get_first_component_by_class(KinematicComponent) for entity in entities]
+        kinematics = [kinematic_cmp for kinematic_cmp in kinematics if kinematic_cmp is not None]
+        centers, start, end, radius = _car_boxes(kinematics)
+        for i, kinematic_cmp in enumerate(kinematics):
+            self.__car_slots[kinematic_cmp.parent] = len(self.__car_alive) + i
+        self.__car_centers = np.concatenate([self.__car_centers, centers])
+        self.__car_radius = np.concatenate([self.__car_radius, radius])
+        self.__car_start = np.concatenate([self.__car_start, start])
+        self.__car_end = np.concatenate([self.__car_end, end])
+        self.__car_alive = np.concatenate([self.__car_alive, np.ones(len(kinematics), dtype=bool)])
+
+        first = len(self.__sensors)
+        origins = []
+        for entity in entities:
+            sensors = entity.get_components_by_class(RangeSensorComponent)
+            if sensors:
+                self.__sensor_slots[entity] = list(range(len(self.__sensors), len(self.__sensors) + len(sensors)))
+                self.__sensors.extend(sensors)
+                origins.extend([entity.get_first_component_by_class(PositionComponent).pos] * len(sensors))
+                self.__max_range = max([self.__max_range] + [sensor_cmp.max_range for sensor_cmp in sensors])
+        self.__sensor_origins = np.concatenate([self.__sensor_origins,
+                                                np.array(origins, dtype=float).reshape(-1, 2)])
+        self.__sensor_alive = np.concatenate([self.__sensor_alive, np.ones(len(origins), dtype=bool)])
+        return np.arange(first, len(self.__sensors))
+
+    def __update(self, state, dt):
+        fresh = self.__add_pending(state) if self.__pending or self.__reset else np.zeros(0, dtype=np.int64)
+        active_sensors = state.get_active_components_by_class(RangeSensorComponent)
+        if not active_sensors and not self.__sensor_alive.any():
+            # Nothing to update. Sensors falling asleep later are computed from scratch
+            self.__moved = (np.zeros((0, 2)), np.zeros(0))
+            return
+
+        # Owner of the car is its slot for sleeping ones and slots count + index for active ones
+        kinematics = state.get_active_components_by_class(KinematicComponent)
+        centers, start, end, radius = _car_boxes(kinematics)
+        first = len(self.__car_alive)
+        owners = dict(self.__car_slots)
+        for i, kinematic_cmp in enumerate(kinematics):
+            owners[kinematic_cmp.parent] = first + i
+
+        # Sleeping sensors near the cars moved since the previous update and just fallen asleep
+        moved_centers = np.concatenate([self.__moved[0], centers])
+        moved_radius = np.concatenate([self.__moved[1], radius])
+        self.__moved = (centers, radius)
+        near = _near_points(self.__sensor_origins, moved_centers,
+                            self.__max_range + (moved_radius.max() if len(moved_radius) else 0.0))
+        slots = np.union1d(near, fresh)
+        sleeping_sensors = [self.__sensors[slot] for slot in slots[self.__sensor_alive[slots]]]
+
+        sensors = active_sensors + sleeping_sensors
+        if not sensors:
+            return
+        sensor_pos, rays, origins, directions, max_ranges, ray_owners = _sensor_rays(sensors, owners)
+
+        # Obstacles: lanes boundaries, active cars boxes and sleeping cars boxes
+        # in the reach of the sensors
+        seg_start, seg_end, seg_owners = [], [], []
+        for road_cmp in state.get_components_by_class(RoadComponent):
+            road_start, road_end = _road_segments(road_cmp)
+            seg_start.append(road_start)
+            seg_end.append(road_end)
+            seg_owners.append(np.full(len(road_start), ROAD_OWNER))
+
+        seg_start.append(start.reshape(-1, 2))
+        seg_end.append(end.reshape(-1, 2))
+        seg_owners.append(np.repeat(first + np.arange(len(kinematics)), 4))
+
+        alive = np.flatnonzero(self.__car_alive)
+        if len(alive):
+            alive = alive[_near_points(self.__car_centers[alive], sensor_pos[rays > 0],
+                                       (max_ranges.max() if len(max_ranges) else 0.0) +
+                                       self.__car_radius[alive].max())]
+        seg_start.append(self.__car_start[alive].reshape(-1, 2))
+        seg_end.append(self.__car_end[alive].reshape(-1, 2))
+        seg_owners.append(np.repeat(alive, 4))
+
+        ranges = cast_rays(origins, directions, max_ranges, ray_owners,
+                           np.concatenate(seg_start), np.concatenate(seg_end), np.concatenate(seg_owners))
+
+        # Slices are copied, views would keep all rays ranges alive while the car sleeps
+        first = 0
+        for sensor_cmp in active_sensors:
+            sensor_cmp.ranges = ranges[first:first + sensor_cmp.rays].copy()
+            first += sensor_cmp.rays
+        for sensor_cmp in sleeping_sensors:
+            # Assignment wakes up the entity, so only changed ranges are assigned
+            sensor_ranges = ranges[first:first + sensor_cmp.rays].copy()
+            if not np.array_equal(sensor_cmp.ranges, sensor_ranges):
+                sensor_cmp.ranges = sensor_ranges
+            first += sensor_cmp.rays
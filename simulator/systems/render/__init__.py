@@ -0,0 +1,39 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Registry of the render backends.
+# Backend is a module, it's imported only when the backend is loaded,
+# so graphics libraries are not required for the headless runs.
+# Backend module provides:
+#   RenderSystem - render system class, constructor takes (size, offscreen, recorder)
+#   input_system - system handling window input, publishes EVENT_QUIT when window is closed
+
+import importlib
+
+__backends = {
+    'pygame': 'simulator.systems.render.pygame_render',
+}
+
+
+def register_backend(name, module):
+    """
+    Registers render backend
+    :param name: Backend name
+    :param module: Full name of the backend module
+    """
+    __backends[name] = module
+
+
+def available_backends():
+    return sorted(__backends)
+
+
+def load_backend(name):
+    """
+    Imports render backend
+    :param name: Backend name
+    :return: Backend module
+    """
+    if name not in __backends:
+        raise ValueError('Unknown render backend "{}", available: {}'.format(name, ', '.join(available_backends())))
+    return importlib.import_module(__backends[name])
@@ -0,0 +1,145 @@
+# This file is licensed under MIT license.
+# See the LICENSE file in the project root for more information.
+
+# Background encoding of the captured frames.
+#
+# Renderer pushes frames (numpy arrays HxWx3, uint8) to the bounded queue,
+# worker threads pull them and pass to the encoder. Simulation loop
+# never waits for the disk unless it's explicitly asked to (block=True).
+# Encoders which can write frames in any order (parallel = True) are used
+# by several workers, image compression releases the GIL.
+
+import os
+import threading
+import numpy as np
+import simulator.helpers.log_helper as log_helper
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+recorder_logger = log_helper.getLogger('Recorder')
+
+
+class RawVideoEncoder(object):
+    """
+    Writes all frames one after another into a single file as raw RGB24.
+    Result can be converted with:
+        ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH -r FPS -i file.rgb out.mp4
+    """
+    parallel = False  # Frames should be written in order
+
+    def __init__(self, path):
+        self.__file = open(path, 'wb')
+
+    def write(self, index, frame):
+        self.__file.write(np.ascontiguousarray(frame).tobytes())
+
+    def close(self):
+        self.__file.close()
+
+
+class ImageSequenceEncoder(object):
+    """
+    Writes every frame to the separate image file.
+    Format is defined by the extension (png, bmp, tga, jpg)
+    """
+    parallel = True  # Every frame is the separate file
+
+    def __init__(self, directory, pattern='frame_{:06d}.png'):
+        import pygame
+        self.__pygame = pygame
+        self.__directory = directory
+        self.__pattern = pattern
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write(self, index, frame):
+        # surfarray works with (width, height) arrays
+        surface = self.__pygame.surfarray.make_surface(frame.swapaxes(0, 1))
+        path = os.path.join(self.__directory, self.__pattern.format(index))
+        self.__pygame.image.save(surface, path)
+
+    def close(self):
+        pass
+
+
+class FrameRecorder(object):
+    """
+    Bounded frames queue with encoding worker threads
+    """
+
+    def __init__(self, encoder, max_frames=64, block=False, workers=4):
+        """
+        :param encoder: Object with write(index, frame), close() methods and parallel attribute
+        :param max_frames: Size of the frames queue
+        :param block: If True push waits for the free place in queue,
+                      otherwise frame is dropped when queue is full
+        :param workers: Count of worker threads, only one is used for not parallel encoder
+        """
+        self.__encoder = encoder
+        self.__queue = queue.Queue(max_frames)
+        self.__block = block
+        self.__lock = threading.Lock()
+        self.__index = 0
+        self.__dropped = 0
+        self.__written = 0
+        self.__workers = []
+        for i in range(workers if encoder.parallel else 1):
+            worker = threading.Thread(target=self.__work, name='FrameRecorder-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self.__workers.append(worker)
+
+    @property
+    def dropped(self):
+        return self.__dropped
+
+    @property
+    def written(self):
+        return self.__written
+
+    def push(self, frame):
+        """
+        Adds frame to the encoding queue
+        :param frame: numpy array HxWx3 of uint8. Recorder takes ownership of the array
+        :return: True if frame queued, False if dropped
+        """
+        try:
+            self.__queue.put((self.__index, frame), self.__block)
+            self.__index += 1
+            return True
+        except queue.Full:
+            with self.__lock:
+                self.__dropped += 1
+            return False
+
+    def close(self):
+        """
+        Waits until all queued frames are encoded and closes the encoder
+        """
+        for worker in self.__workers:
+            self.__queue.put(None)
+        for worker in self.__workers:
+            worker.join()
+        self.__encoder.close()
+        if self.__dropped > 0:
+            recorder_logger.warning('Recorded {} frames, dropped {}'.format(self.__written, self.__dropped))
+        else:
+            recorder_logger.info('Recorded {} frames'.format(self.__written))
+
+    def __work(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            index, frame = item
+            try:
+                self.__encoder.write(index, frame)
+                with self.__lock:
+                    self.__written += 1
+            except Exception as e:
+                with self.__lock:
+                    self.__dropped += 1
+                recorder_logger.error('Frame encoding failed: {}'.format(e))
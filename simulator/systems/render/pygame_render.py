@@ -2,19 +2,45 @@
 # See the LICENSE file in the project root for more information.
 
 import pygame
+import numpy as np
 from simulator.ecs.core import EventBus
 import simulator.ecs.stdevent as stdevent
-from simulator.components.components import *
-from simulator.systems.systems import *
+from simulator.components.components import PositionComponent, KinematicComponent, VisualComponent, CameraComponent
 import simulator.events as events
 import simulator.helpers.log_helper as log_helper
+from simulator.helpers.spatial_grid import SpatialGrid
 
 render_logger = log_helper.getLogger('Render')
 
+# Camera control
+CAMERA_PAN_SPEED = 300.0
+CAMERA_ZOOM_STEP = 1.1
+
+
+def input_system(state, dt):
+    """
+    Handles window events: closing the window publishes EVENT_QUIT,
+    arrow keys pan the camera and mouse wheel zooms it
+    """
+    camera_cmp = next(iter(state.get_components_by_class(CameraComponent)), None)
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            EventBus.publish(events.EVENT_QUIT)
+        elif event.type == pygame.MOUSEBUTTONDOWN and camera_cmp is not None:
+            if event.button == 4:
+                camera_cmp.zoom *= CAMERA_ZOOM_STEP
+            elif event.button == 5:
+                camera_cmp.zoom /= CAMERA_ZOOM_STEP
+
+    if camera_cmp is not None:
+        keys = pygame.key.get_pressed()
+        pan = np.array([keys[pygame.K_RIGHT] - keys[pygame.K_LEFT], keys[pygame.K_DOWN] - keys[pygame.K_UP]], dtype=float)
+        camera_cmp.center = camera_cmp.center + pan * CAMERA_PAN_SPEED * dt / camera_cmp.zoom
+
 
 class Sprite(pygame.sprite.Sprite):
     """
-    Sprite wrapper with simplified position and rotation set
+    Sprite wrapper with simplified position, rotation and scale set
     """
     def __init__(self, pos, size,  color):
         pygame.sprite.Sprite.__init__(self)
@@ -22,8 +48,10 @@ class Sprite(pygame.sprite.Sprite):
         self.__image0.fill((0, 0, 0, 0))
         self.__image0.set_colorkey((0, 0, 0, 0))
         pygame.draw.rect(self.__image0, color, (1, 1, size[0], size[1]))  # When rect size == surf size, rotate not work
+        self.__scaled = self.__image0
         self.__rect0 = self.__image0.get_rect(center=pos)
         self.__rot = 0
+        self.__zoom = 1.0
         self.__apply_transform()
 
     @property
@@ -33,7 +61,7 @@ class Sprite(pygame.sprite.Sprite):
     @pos.setter
     def pos(self, value):
         self.__rect0.center = value
-        self.__apply_transform()
+        self.rect.center = value
 
     @property
     def rot(self):
@@ -44,20 +72,88 @@ class Sprite(pygame.sprite.Sprite):
         self.__rot = value
         self.__apply_transform()
 
+    @property
+    def zoom(self):
+        return self.__zoom
+
+    @zoom.setter
+    def zoom(self, value):
+        self.set_transform(self.pos, self.rot, value)
+
+    @property
+    def radius(self):
+        """
+        Half of the diagonal of the not scaled image
+        """
+        w, h = self.__image0.get_size()
+        return 0.5 * (w*w + h*h) ** 0.5
+
+    def set_transform(self, pos, rot, zoom):
+        """
+        Sets all transformations at once.
+        Image is transformed only if rotation or scale changed
+        """
+        self.__rect0.center = pos
+        if zoom != self.__zoom:
+            self.__zoom = zoom
+            w, h = self.__image0.get_size()
+            self.__scaled = pygame.transform.scale(self.__image0, (max(1, int(w*zoom)), max(1, int(h*zoom))))
+            self.__rot = rot
+            self.__apply_transform()
+        elif rot != self.__rot:
+            self.__rot = rot
+            self.__apply_transform()
+        else:
+            self.rect.center = self.__rect0.center
+
     def __apply_transform(self):
-        self.image = pygame.transform.rotate(self.__image0, self.rot)
+        self.image = pygame.transform.rotate(self.__scaled, self.rot)
         self.rect = self.image.get_rect(center=self.__rect0.center)
 
 
 class PyGameRenderSystem:
     """
-    Rendering with pygame
+    Rendering with pygame.
+    World is viewed through the first CameraComponent in the Engine (if there is
+    no camera, world coordinates are equal to the screen coordinates). Only
+    sprites inside the viewport are transformed and drawn, they are found with
+    spatial grid over the entities positions.
+    In offscreen mode everything is drawn to the pygame.Surface, no window
+    and display are required. Rendered frames can be passed to the recorder
+    (see frame_recorder.FrameRecorder) for the background encoding.
+    Rendering is decoupled from the simulation: EVENT_SNAPSHOT (published by
+    the main loop after the two last steps before the frame) stores the entities
+    state to the double buffer, frame is drawn on EVENT_RENDER with state
+    interpolated between these two steps.
     """
-    def __init__(self):
+    def __init__(self, size=(600, 600), offscreen=False, recorder=None, grid_cell=200):
+        """
+        :param size: Window (or offscreen surface) size
+        :param offscreen: Render to the surface instead of window
+        :param recorder: Object with push(frame) method, every rendered frame will be
+                         sent to it as numpy array HxWx3 of uint8
+        :param grid_cell: Cell size of the spatial grid in world units
+        """
         render_logger.debug('Initialization')
+        self.__size = size
+        self.__offscreen = offscreen
+        self.__recorder = recorder
+        self.__camera_cmp = None
+        self.__grid = SpatialGrid(grid_cell)  # Rows of the visuals by current positions
+        self.__cells = np.zeros((0, 2), dtype=np.int64)  # Grid cells of the rows
+        self.__displacement = 0.0  # Largest displacement between the two buffered steps
+        self.__max_radius = 0
+        self.__visuals = []
+        self.__active = None  # Rows and PositionComponents of the active visuals, dropped on sleep and wake
+        self.__fallen_asleep = []  # Visuals of the entities fallen asleep since the last snapshot
+        # Double buffer of the [x, y, rot] states: previous and current simulation steps
+        self.__states = [np.zeros((0, 3)), np.zeros((0, 3))]
         EventBus.subscribe(stdevent.EVENT_SETUP, self.__setup)
         EventBus.subscribe(stdevent.EVENT_TEARDOWN, self.__teardown)
-        EventBus.subscribe(stdevent.EVENT_UPDATE, self.__update)
+        EventBus.subscribe(stdevent.EVENT_ENTITY_SLEEP, self.__entity_sleep)
+        EventBus.subscribe(stdevent.EVENT_ENTITY_WAKE, self.__entity_wake)
+        EventBus.subscribe(events.EVENT_SNAPSHOT, self.__snapshot)
+        EventBus.subscribe(events.EVENT_RENDER, self.__render)
         EventBus.subscribe(events.EVENT_INIT_GRAPHICS, self.__setup_graphics)
 
     # setup renderer and set pygame
@@ -65,36 +161,174 @@ class PyGameRenderSystem:
         render_logger.debug('Setup')
         self.__engine = engine
 
-        pygame.init()
-        self.__screen = pygame.display.set_mode((600, 600), 0, 32)
-        pygame.display.set_caption("Simple Car Simulator")
+        if self.__offscreen:
+            self.__screen = pygame.Surface(self.__size, 0, 24)
+        else:
+            pygame.init()
+            self.__screen = pygame.display.set_mode(self.__size, 0, 32)
+            pygame.display.set_caption("Simple Car Simulator")
         self.__bg_color = pygame.Color(255, 255, 255, 255)
 
     # Called after all VisualComponent created and create their visual representation
     # Dynamic VisualComponent adding/removing not supported for now
     def __setup_graphics(self, engine):
-        sprites = []
-        for visual_comp in self.__engine.get_components_by_class(VisualComponent):
+        self.__camera_cmp = next(iter(self.__engine.get_components_by_class(CameraComponent)), None)
+        self.__visuals = list(self.__engine.get_components_by_class(VisualComponent))
+        for order, visual_comp in enumerate(self.__visuals):
             position_cmp = visual_comp.parent.get_first_component_by_class(PositionComponent)
             kinematic_cmp = visual_comp.parent.get_first_component_by_class(KinematicComponent)
             sprite = Sprite(position_cmp.pos, kinematic_cmp.size, visual_comp.color)
             visual_comp.ext.sprite = sprite
-            sprites.append(sprite)
-        self.__allsprites = pygame.sprite.RenderPlain(sprites)
+            visual_comp.ext.position = position_cmp
+            visual_comp.ext.order = order
+            self.__max_radius = max(self.__max_radius, sprite.radius)
+        self.__states = [np.zeros((len(self.__visuals), 3)), np.zeros((len(self.__visuals), 3))]
+        self.__store_state(self.__states[0], [visual_comp.ext.position for visual_comp in self.__visuals])
+        self.__states[1][:] = self.__states[0]
+        self.__active = None
+        self.__fallen_asleep = []
+        self.__grid.clear()
+        self.__cells = np.floor(self.__states[1][:, 0:2] / self.__grid.cell_size).astype(np.int64)
+        for order, pos in enumerate(self.__states[1][:, 0:2]):
+            self.__grid.update(order, pos)
+        self.__displacement = 0.0
 
     # Deinit pygame
-    def __teardown(self, engine):
+    def __teardown(self, *args):
         render_logger.debug('Teardown')
-        pygame.quit()
+        if not self.__offscreen:
+            pygame.quit()
+
+    @property
+    def surface(self):
+        """
+        Surface the scene rendered to
+        """
+        return self.__screen
+
+    def capture(self):
+        """
+        Copies current frame
+        :return: numpy array HxWx3 of uint8
+        """
+        # array3d returns (width, height, 3) copy of the pixels
+        return pygame.surfarray.array3d(self.__screen).swapaxes(0, 1)
+
+    # Gets camera center and zoom
+    def __camera(self):
+        if self.__camera_cmp is None:
+            return np.array(self.__size, dtype=float) / 2, 1.0
+        return self.__camera_cmp.center, self.__camera_cmp.zoom
+
+    # Gets sorted rows from the grid cells overlapped by the viewport, padded by the sprite radius and margin
+    def __candidates(self, center, zoom, margin):
+        half = np.array(self.__size, dtype=float) / (2 * zoom) + self.__max_radius + margin
+        return np.array(sorted(self.__grid.query(center - half, center + half)), dtype=np.intp)
+
+    # Gets indices of the sprites inside the viewport at any moment between previous and current steps,
+    # indices are sorted, so drawing order is stable. Grid holds the current positions, its query is
+    # padded by the largest displacement to catch the sprites which were inside at the previous step
+    def __visible(self, center, zoom):
+        half = np.array(self.__size, dtype=float) / (2 * zoom) + self.__max_radius
+        candidates = self.__candidates(center, zoom, self.__displacement)
+        prev_pos = self.__states[0][candidates, 0:2]
+        cur_pos = self.__states[1][candidates, 0:2]
+        inside = np.all((np.minimum(prev_pos, cur_pos) <= center + half) &
+                        (np.maximum(prev_pos, cur_pos) >= center - half), axis=1)
+        return candidates[inside]
+
+    # Copies state of the entities to the buffer
+    @staticmethod
+    def __store_state(state, positions):
+        if positions:
+            state[:, 0:2] = np.concatenate([position_cmp.pos for position_cmp in positions]).reshape(-1, 2)
+            state[:, 2] = [position_cmp.rot for position_cmp in positions]
+
+    # Sleeping entity is stored once more, its last step could be missed by the snapshots
+    def __entity_sleep(self, entity):
+        self.__fallen_asleep.extend(visual_comp for visual_comp in entity.get_components_by_class(VisualComponent)
+                                    if hasattr(visual_comp.ext, 'order'))
+        self.__active = None
+
+    def __entity_wake(self, entity):
+        self.__active = None
+
+    # Gets rows and PositionComponents of the visuals changed since the last snapshot
+    def __changed(self, engine):
+        if self.__active is None:
+            active = engine.get_active_components_by_class(VisualComponent)
+            self.__active = (np.array([visual_comp.ext.order for visual_comp in active], dtype=np.intp),
+                             [visual_comp.ext.position for visual_comp in active])
+        rows, positions = self.__active
+        if self.__fallen_asleep:
+            rows = np.concatenate([rows, np.array([visual_comp.ext.order for visual_comp in self.__fallen_asleep],
+                                                  dtype=np.intp)])
+            positions = positions + [visual_comp.ext.position for visual_comp in self.__fallen_asleep]
+            self.__fallen_asleep = []
+        return rows, positions
+
+    # Moves the rows changed their cells in the grid, rows staying in the same cell are not touched
+    def __update_grid(self, rows, pos, last_pos):
+        self.__displacement = np.sqrt(np.max(np.sum((pos - last_pos) ** 2, axis=1)))
+        cells = np.floor(pos / self.__grid.cell_size).astype(np.int64)
+        moved = np.flatnonzero(np.any(cells != self.__cells[rows], axis=1))
+        for i in moved:
+            self.__grid.update(int(rows[i]), pos[i])
+        self.__cells[rows[moved]] = cells[moved]
+
+    # Store simulation state, previous state becomes the back buffer.
+    # Sleeping entities don't change, their state is copied from the previous snapshot
+    # and they are not touched in the grid. Positions of the changed entities are needed
+    # by the grid, but rotation is read only for the rows near the viewport (padded by one
+    # more step of movement), rotation of the other rows is unknown (NaN)
+    def __snapshot(self, engine):
+        prev_state, cur_state = self.__states
+        prev_state[:] = cur_state
+        rows, positions = self.__changed(engine)
+        self.__displacement = 0.0
+        if positions:
+            prev_state[rows, 0:2] = np.concatenate([position_cmp.pos for position_cmp in positions]).reshape(-1, 2)
+            self.__update_grid(rows, prev_state[rows, 0:2], cur_state[rows, 0:2])
+            center, zoom = self.__camera()
+            candidates = self.__candidates(np.asarray(center, dtype=float), zoom, 2 * self.__displacement)
+            near = np.flatnonzero(np.isin(rows, candidates))
+            prev_state[rows, 2] = np.nan
+            prev_state[rows[near], 2] = [positions[i].rot for i in near]
+        self.__states = [cur_state, prev_state]
 
     # Update sprites and do rendering
-    def __update(self, engine, dt):
+    # alpha - position of the rendered frame between previous (0) and current (1) simulation steps
+    def __render(self, engine, alpha):
         self.__screen.fill(self.__bg_color)
 
-        for visual_comp in self.__engine.get_components_by_class(VisualComponent):
-            position_cmp = visual_comp.parent.get_first_component_by_class(PositionComponent)
-            visual_comp.ext.sprite.pos = position_cmp.pos
-            visual_comp.ext.sprite.rot = position_cmp.rot
+        center, zoom = self.__camera()
+        offset = np.array(self.__size, dtype=float) / 2 - np.asarray(center) * zoom
+        visible = self.__visible(np.asarray(center, dtype=float), zoom)
+        if len(visible):
+            prev_state = self.__states[0][visible]
+            cur_state = self.__states[1][visible]
+            # Unknown current rotation is read from the component (frame is drawn right after the snapshot),
+            # unknown previous rotation is not interpolated
+            unknown = np.flatnonzero(np.isnan(cur_state[:, 2]))
+            if len(unknown):
+                cur_state[unknown, 2] = [self.__visuals[i].ext.position.rot for i in visible[unknown]]
+                self.__states[1][visible[unknown], 2] = cur_state[unknown, 2]
+            prev_state[:, 2] = np.where(np.isnan(prev_state[:, 2]), cur_state[:, 2], prev_state[:, 2])
+            state = prev_state + (cur_state - prev_state) * alpha
+            # Rotation is interpolated over the shortest arc
+            state[:, 2] = prev_state[:, 2] + ((cur_state[:, 2] - prev_state[:, 2] + 180) % 360 - 180) * alpha
+            screen_pos = np.rint(state[:, 0:2] * zoom + offset).astype(int)
+
+            for i, pos, rot in zip(visible, screen_pos, state[:, 2]):
+                sprite = self.__visuals[i].ext.sprite
+                sprite.set_transform((pos[0], pos[1]), rot, zoom)
+                self.__screen.blit(sprite.image, sprite.rect)
+
+        if not self.__offscreen:
+            pygame.display.update()
+        if self.__recorder is not None:
+            self.__recorder.push(self.capture())
+
 
-        self.__allsprites.draw(self.__screen)
-        pygame.display.update()
\ No newline at end of file
+# Render backend interface, see simulator.systems.render.load_backend
+RenderSystem = PyGameRenderSystem
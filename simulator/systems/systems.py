@@ -1,13 +1,96 @@
 # This file is licensed under MIT license.
 # See the LICENSE file in the project root for more information.
 
-from simulator.components.components import *
+import numpy as np
+import simulator.ecs.stdevent as stdevent
+import simulator.events as events
+from simulator.ecs.core import EventBus
+from simulator.components.components import PositionComponent, ControlComponent, KinematicComponent
+from simulator.helpers.spatial_grid import SpatialGrid
+
+# Number of the steps car should stay still before falling asleep
+SLEEP_STEPS = 30
+
+# Distance from the moving car at which sleeping entities are woken up
+WAKE_RADIUS = 50.0
 
 
 def control_system(state, dt):
-    for control_cmp in state.get_components_by_class(ControlComponent):
+    for control_cmp in state.get_active_components_by_class(ControlComponent):
         position_cmp = control_cmp.parent.get_first_component_by_class(PositionComponent)
         kinematic_cmp = control_cmp.parent.get_first_component_by_class(KinematicComponent)
         kinematic_cmp.speed += control_cmp.acc * dt
         position_cmp.pos += kinematic_cmp.speed * dt
-        position_cmp.rot += 1
\ No newline at end of file
+        position_cmp.rot += 1
+
+
+def sleep_system(state, dt):
+    """
+    Puts to sleep cars which don't move and don't accelerate for SLEEP_STEPS steps
+    """
+    for control_cmp in state.get_active_components_by_class(ControlComponent):
+        kinematic_cmp = control_cmp.parent.get_first_component_by_class(KinematicComponent)
+        if control_cmp.acc.any() or kinematic_cmp.speed.any():
+            control_cmp.idle_steps = 0
+            continue
+        control_cmp.idle_steps += 1
+        if control_cmp.idle_steps >= SLEEP_STEPS:
+            control_cmp.idle_steps = 0
+            control_cmp.parent.sleep()
+
+
+class WakeSystem(object):
+    """
+    Wakes up sleeping entities near the moving cars.
+    Sleeping entities don't move, so their positions are kept in the grid
+    from the moment they fall asleep. Any system can wake up the area by
+    publishing EVENT_WAKE_AREA (pos, radius).
+    Should be subscribed after the systems moving the cars.
+    """
+
+    def __init__(self, radius=WAKE_RADIUS, grid_cell=200.0):
+        """
+        :param radius: Distance from the moving car within which sleeping entities are woken up
+        :param grid_cell: Cell size of the sleeping entities grid
+        """
+        self.__radius = radius
+        self.__grid = SpatialGrid(grid_cell)
+        self.__positions = {}  # {entity: position at the moment of falling asleep}
+
+        EventBus.subscribe(stdevent.EVENT_ENTITY_SLEEP, self.__entity_sleep)
+        EventBus.subscribe(stdevent.EVENT_ENTITY_WAKE, self.__forget)
+        EventBus.subscribe(stdevent.EVENT_ENTITY_REMOVED, self.__forget)
+        EventBus.subscribe(stdevent.EVENT_UPDATE, self.__update)
+        EventBus.subscribe(events.EVENT_WAKE_AREA, self.wake_near)
+
+    def wake_near(self, pos, radius):
+        """
+        Wakes up all sleeping entities closer than radius to the position
+        :param pos: Position of the event
+        :param radius: Radius of the event
+        """
+        if not self.__positions:
+            return
+        for entity in self.__grid.query_radius(pos, radius):
+            position = self.__positions.get(entity)
+            if position is not None and np.hypot(position[0] - pos[0], position[1] - pos[1]) <= radius:
+                entity.wake()
+
+    def __entity_sleep(self, entity):
+        position_cmp = entity.get_first_component_by_class(PositionComponent)
+        if position_cmp is not None:
+            self.__positions[entity] = np.array(position_cmp.pos, dtype=float)
+            self.__grid.update(entity, position_cmp.pos)
+
+    def __forget(self, entity):
+        if self.__positions.pop(entity, None) is not None:
+            self.__grid.remove(entity)
+
+    def __update(self, state, dt):
+        if not self.__positions:
+            return
+        for kinematic_cmp in state.get_active_components_by_class(KinematicComponent):
+            if kinematic_cmp.speed.any():
+                position_cmp = kinematic_cmp.parent.get_first_component_by_class(PositionComponent)
+                if position_cmp is not None:
+                    self.wake_near(position_cmp.pos, self.__radius)